@@ -8,7 +8,11 @@ __usage__ = """
 		Calculation of FASTQ statististics (""" + __version__ + """):
 		
 		python3 FASTQ_stats3.py
-		--in <FULL_PATH_TO_FASTQ_FILE> |	--in_dir <FULL_PATH_TO_DIRECTORY>
+		--in <FULL_PATH_TO_FASTQ_FILE> |	--in_dir <FULL_PATH_TO_DIRECTORY> | --merge <SUMMARY_FILE1,SUMMARY_FILE2,...>
+		
+		python3 FASTQ_stats3.py plot
+		--summary <SUMMARY_FILE1,SUMMARY_FILE2,...>
+		--rfig <READ_LEN_HIST_FIGURE_FILE> and/or --qfig <QUALITY_VS_READ_LEN_FIGURE_FILE>
 		
 		optional:
 		--rfig <READ_LEN_HIST_FIGURE_FILE>
@@ -17,152 +21,1080 @@ __usage__ = """
 		--lencut <UPPER_READ_LENGTH_CUTOFF_FOR_PLOT_IN_KB>[200]
 		--qualcut <UPPER_QUAL_CUTOFF_FOR_PLOT>[40]
 		--quality <ACTIVATES_QUALITY_ANALYSIS>
+		--qualmode <mean|error>[mean]
+		--threads <NUMBER_OF_FILES_ANALYZED_IN_PARALLEL>[1]	(only --in_dir)
+		--decompressor <auto|python|pigz|igzip>[auto]
+		--timing <ACTIVATES_REPORT_OF_DECOMPRESSION_AND_PARSING_TIME>
+		--kmer <KMER_SIZE_FOR_GENOME_SIZE_ESTIMATION>[off]	(--in or --in_dir)
+		--kmer_scale <COUNT_ONE_OF_N_KMERS>[1000]
+		--kmer_hist <KMER_SPECTRUM_OUTPUT_FILE>
+		--summary <SUMMARY_OUTPUT_FILE>	(--in or --merge)
+		--sample <reservoir:READS|every:K|time:SECONDS|bytes:BYTES>	(--in)
+		--follow <ACTIVATES_MONITORING_OF_GROWING_FILES>
+		--interval <SECONDS_BETWEEN_UPDATES>[60]	(--follow)
+		--follow_stop <STOP_AFTER_SECONDS_WITHOUT_NEW_DATA>[off]	(--follow)
+		--summary_dir <SUMMARY_OUTPUT_FOLDER>	(--in_dir)
+		--cache <ACTIVATES_CACHE_OF_FILE_STATISTICS>	(--in_dir)
+		--cache_file <CACHE_DATABASE_FILE>[<IN_DIR>/.FASTQ_stats3_cache.sqlite]
+		--cache_hash <ACTIVATES_CONTENT_HASH_COMPARISON>
+		--clear_cache <INVALIDATES_ALL_CACHED_STATISTICS>
+		--cache_size <MAX_CACHE_SIZE_IN_MB>[500]
 		
 		bug reports and feature requests: b.pucker@tu-bs.de
 		"""
 
-import sys, gzip, glob
-try:
-	import matplotlib.pyplot as plt
-	import matplotlib.ticker as ticker
-	import pandas as pd
-	import seaborn as sns
-except ImportError:
-	sys.stdout.write( "WARNING: matplotlib import failed - figure plotting not possible.\n" )
-	sys.stdout.flush()
+import os, sys, io, gzip, zlib, glob, time, queue, shutil, hashlib, sqlite3, threading, subprocess, concurrent.futures
+import numpy as np
+#matplotlib, pandas and seaborn are imported by import_plotting_modules only if figures are requested
 
 
 # --- end of imports --- #
 
-def calculate_n50( total_length ):
-	"""! @brief calculate N50 based on list of given read lengths """
+BLOCK_SIZE = 16 * 1024 * 1024	#bytes per read() call of the FASTQ parser
+PHRED_ERROR_PROB = 10.0 ** ( -( np.arange( 256 ) - 33.0 ) / 10.0 )	#error probability per quality character
+LEN_BIN_SIZE = 1000	#read length bin size (bp) of the binned quality vs. read length histogram
+QUAL_BIN_SIZE = 0.5	#average quality bin size (Phred) of the binned quality vs. read length histogram
+QUAL_BIN_NUMBER = 121	#average qualities above 60 are counted in the last bin
+KMER_CODES = np.full( 256, 4, dtype=np.uint8 )	#2-bit code per base; 4 marks N and other characters
+KMER_CODES[ list( b"AaCcGgTt" ) ] = [ 0, 0, 1, 1, 2, 2, 3, 3 ]
+KMER_SCALE = 1000	#fraction 1/KMER_SCALE of all distinct k-mers is counted
+KMER_CHUNK_SIZE = 1048576	#bases per vectorized k-mer extraction
+KMER_TABLE_SIZE = 2097152	#maximal number of distinct sampled k-mers; the sampled fraction is reduced once the table is full
+KMER_MAX_COVERAGE = 10000	#k-mers with higher coverage are counted in the last bin of the spectrum
+QUEUE_SIZE = 4	#maximal number of decompressed blocks waiting for the parser
+QUAL_RESERVOIR_SIZE = 10000	#reads drawn as scatter and KDE layers of the quality vs. read length figure
+RESERVOIR_SEED = 1
+BOOTSTRAP_ROUNDS = 200	#resamplings for confidence intervals of sample estimates
+BOOTSTRAP_MAX_DRAWS = 100000	#maximal number of resampled reads per round; larger samples get rescaled confidence intervals
+BOOTSTRAP_BATCH_SIZE = 2000000	#maximal number of resampled reads (all rounds of a batch) processed at once
+SAMPLE_GZIP_READ_SIZE = 262144	#decompressed bytes per read() call when sampling the first bytes of a gzip file
+
+
+def calculate_n50( len_counts ):
+	"""! @brief calculate N50 based on read length histogram (number of reads per read length) """
 	
-	total = sum( total_length )
-	half = total / 2.0
-	sorted_lengths = sorted( total_length )[::-1]
-	counter = 0
-	i = 0
-	for i in range( len( sorted_lengths ) ):
-		counter += sorted_lengths[ i ]
-		if counter >= half:
-			return sorted_lengths[ i ]
-	sys.exit( "ERROR: no read lengths detected." )
+	bases_per_length = len_counts * np.arange( len( len_counts ) )
+	total = bases_per_length.sum()
+	if total == 0:
+		sys.exit( "ERROR: no read lengths detected." )
+	cum_bases = np.cumsum( bases_per_length[::-1] )	#starting with the longest reads
+	return int( len( len_counts ) - 1 - np.searchsorted( cum_bases, total / 2.0 ) )
 
 
-def calc_avg_qual( qual ):
-	"""! @brief quality """
+def calc_avg_quals( quals, qual_mode="mean" ):
+	"""! @brief calculate average quality of a batch of reads in one vectorized pass
+	
+		@param quals (list) quality lines (bytes) of the FASTQ records
+		
+		@param qual_mode (string) "mean" averages the Phred scores; "error" averages the error probabilities and converts the result back into a Phred score
+		
+		@return (numpy array) average quality per read
+	"""
 	
-	quality_values = []
-	for q in qual:
-		quality_values.append( ord( q ) - 33.0 )
-	return sum( quality_values ) / float( len( quality_values ) )
+	lengths = np.fromiter( map( len, quals ), dtype=np.int64, count=len( quals ) )
+	ends = np.cumsum( lengths )
+	values = np.frombuffer( b"".join( quals ), dtype=np.uint8 )
+	if qual_mode == "error":
+		cum_values = np.concatenate( ( [ 0.0 ], np.cumsum( PHRED_ERROR_PROB[ values ] ) ) )
+	else:
+		cum_values = np.concatenate( ( [ 0 ], np.cumsum( values, dtype=np.int64 ) ) )
+	sums = cum_values[ ends ] - cum_values[ ends - lengths ]
+	with np.errstate( divide="ignore", invalid="ignore" ):
+		if qual_mode == "error":
+			avg_quals = -10.0 * np.log10( sums / lengths )
+		else:
+			avg_quals = ( sums / lengths ) - 33.0
+	avg_quals[ lengths == 0 ] = 0.0
+	return avg_quals
 
 
-def analyze_FASTQ( filename, qual_status ):
-	"""! @brief analysis of FASTQ file """
+def is_gzip_file( filename ):
+	"""! @brief check if file is gzip compressed based on file extension """
+	
+	return filename.split('.')[-1] in [ "gz", "gzip", "GZ", "GZIP" ]
+
+
+def decompress_gzip_block( state, block ):
+	"""! @brief decompress next bytes of a (multi-member) gzip file; the file can still be growing """
+	
+	data = []
+	while block:
+		data.append( state['decompressor'].decompress( block ) )
+		if state['decompressor'].eof and len( state['decompressor'].unused_data ) > 0:	#next gzip member
+			block = state['decompressor'].unused_data
+			state['decompressor'] = zlib.decompressobj( 16 + zlib.MAX_WBITS )
+		else:
+			block = b""
+	return b"".join( data )
+
+
+def put_block( blocks, item, stop ):
+	"""! @brief put item into bounded queue unless the consumer stopped reading """
+	
+	while not stop.is_set():
+		try:
+			blocks.put( item, timeout=0.1 )
+			return
+		except queue.Full:
+			pass
+
+
+def produce_blocks( source, gzip_state, blocks, stop, timing ):
+	"""! @brief read (and decompress) blocks of source and put them into bounded queue; None marks the end of the file """
 	
-	gzip_state = False
 	try:
-		file_extension = filename.split('.')[-1]
-		if file_extension in [ "gz", "gzip", "GZ", "GZIP" ]:
-			gzip_state = True
-	except:
-		pass
+		state = { 'decompressor': zlib.decompressobj( 16 + zlib.MAX_WBITS ) }
+		compressed_data = False
+		while not stop.is_set():
+			start_time = time.perf_counter()
+			raw = source.read( BLOCK_SIZE )
+			if not raw:
+				break
+			if gzip_state:
+				compressed_data = True
+				block = decompress_gzip_block( state, raw )
+			else:
+				block = raw
+			timing['decompression'] += time.perf_counter() - start_time
+			if len( block ) > 0:
+				put_block( blocks, block, stop )
+		if compressed_data and not state['decompressor'].eof:
+			raise EOFError( "compressed file ended before the end-of-stream marker was reached" )
+		put_block( blocks, None, stop )
+	except Exception as error:
+		put_block( blocks, error, stop )
+
+
+def read_FASTQ_blocks( filename, decompressor="auto", timing=None ):
+	"""! @brief yield (decompressed) blocks of FASTQ file; reading and decompression run in a separate thread (or external process) that hands the blocks to the parser through a bounded queue
 	
-	if not gzip_state:
-		with open( filename, "r" ) as f:
-			total_length = []
-			average_quality = []
-			total_GC = []
-			line = f.readline()	#header
-			while line:
-				seq = f.readline().strip().upper()
-				total_length.append( len( seq ) )
-				total_GC.append( seq.count('C') )
-				total_GC.append( seq.count('G') )
-				f.readline()	#useless line
-				qual = f.readline()	#quality line
-				if qual_status:
-					average_quality.append( calc_avg_qual( qual ) )
-				line = f.readline()
-			
-			total_len = sum( total_length )
-			total_gc = sum( total_GC )
-			n50 = calculate_n50( total_length )
-			
-			sys.stdout.write(  filename + "\n" )
-			sys.stdout.write(  "total number of nucleotides:\t" + str( total_len / 1000000000.0 ) + " Gbp\n" )
-			sys.stdout.write(  "N50: " + str( n50 ) + "\n" )
-			sys.stdout.write( "number of reads: " + str( len( total_length ) ) + "\n" )
-			
-			sys.stdout.write(  "average read length:\t" + str( total_len / float( len( total_length ) ) ) + "\n" )
-			sys.stdout.write(  "GC content:\t" + str( total_gc / float( total_len ) ) + "\n" )
-			
-			if qual_status:
-				if len( average_quality ) > 0:
-					sum_avg_qual = sum( average_quality ) / len( average_quality )
-				else:
-					sum_avg_qual = 0
-				sys.stdout.write( "average read quality score: " + str( sum_avg_qual ) + "\n" )
-			
+		@param decompressor (string) "python" (zlib in a separate thread), "pigz" or "igzip" (external process), or "auto" (igzip or pigz if available, python otherwise)
+		
+		@param timing (dictionary) seconds spent on reading/decompression ('decompression') and by the parser waiting for data ('waiting') are added (optional)
+	"""
+	
+	if timing is None:
+		timing = {}
+	timing.setdefault( 'decompression', 0.0 )
+	timing.setdefault( 'waiting', 0.0 )
+	
+	external = None
+	if is_gzip_file( filename ):
+		if decompressor == "auto":
+			for tool in [ "igzip", "pigz" ]:
+				if shutil.which( tool ):
+					external = tool
+					break
+		elif decompressor != "python":
+			external = decompressor
+	
+	process = None
+	if external is not None:
+		process = subprocess.Popen( [ external, "-dc", filename ], stdout=subprocess.PIPE )
+		source = process.stdout
+	else:
+		source = open( filename, "rb" )
+	
+	blocks = queue.Queue( maxsize=QUEUE_SIZE )
+	stop = threading.Event()
+	producer = threading.Thread( target=produce_blocks, args=( source, external is None and is_gzip_file( filename ), blocks, stop, timing ), daemon=True )
+	producer.start()
+	try:
+		while True:
+			start_time = time.perf_counter()
+			block = blocks.get()
+			timing['waiting'] += time.perf_counter() - start_time
+			if block is None:
+				break
+			if isinstance( block, Exception ):
+				raise block
+			yield block
+		if process is not None and process.wait() != 0:
+			raise OSError( external + " failed to decompress " + filename )
+	finally:
+		stop.set()
+		if process is not None and process.poll() is None:
+			process.kill()
+		producer.join()
+		source.close()
+		if process is not None:
+			process.wait()
+
+
+def split_FASTQ_block( block ):
+	"""! @brief split buffer into lines of complete FASTQ records and the remaining bytes of an incomplete record """
+	
+	if b"\r" in block:
+		block = block.replace( b"\r", b"" )
+	lines = block.split( b"\n" )
+	rest = lines.pop()	#bytes after the last line break
+	incomplete = len( lines ) % 4
+	if incomplete:
+		rest = b"\n".join( lines[ -incomplete: ] + [ rest ] )
+		del lines[ -incomplete: ]
+	return lines, rest
+
+
+def iter_FASTQ_blocks( blocks, truncated=False ):
+	"""! @brief yield lines of complete FASTQ records (multiple of four) from given iterable of large byte blocks
+	
+		@param truncated (boolean) blocks end within the file; an incomplete last record is dropped silently
+	"""
+	
+	rest = b""
+	for block in blocks:
+		lines, rest = split_FASTQ_block( rest + block )
+		if len( lines ) > 0:
+			yield lines
+	if truncated:
+		return
+	rest = rest.rstrip()
+	if len( rest ) > 0:	#last record without line break at end of file
+		lines, rest = split_FASTQ_block( rest + b"\n" )
+		if len( lines ) > 0:
+			yield lines
+		if len( rest ) > 0:
+			sys.stdout.write( "WARNING: incomplete FASTQ record at end of file ignored.\n" )
 			sys.stdout.flush()
+
+
+def new_FASTQ_stats( kmer_size=0, kmer_scale=KMER_SCALE ):
+	"""! @brief create empty statistics accumulator; memory depends on the longest read, not on the number of reads
+	
+		len_counts: number of reads per read length (index = read length)
+		total_gc: number of G and C
+		qual_sum: sum of average read qualities
+		len_qual_hist: number of reads per read length bin (rows, LEN_BIN_SIZE) and average quality bin (columns, QUAL_BIN_SIZE)
+		qual_reservoir: uniform random sample of at most QUAL_RESERVOIR_SIZE reads (rows: read length, average quality) out of qual_reads_seen reads
+		kmer_hashes, kmer_counts, kmer_pending: counts of hash-sampled canonical k-mers (only if kmer_size > 0)
+		kmer_max_hash: only k-mers with smaller hash values are counted (fraction kmer_max_hash/2**64)
+	"""
+	
+	stats = {	'len_counts': np.zeros( 1, dtype=np.int64 ),
+				'total_gc': 0,
+				'qual_sum': 0.0,
+				'len_qual_hist': np.zeros( ( 1, QUAL_BIN_NUMBER ), dtype=np.int64 ),
+				'qual_reservoir': np.zeros( ( 0, 2 ) ),
+				'qual_reads_seen': 0,
+				'rng': np.random.default_rng( RESERVOIR_SEED )
+			}
+	if kmer_size > 0:
+		stats.update( {	'kmer_size': kmer_size,
+						'kmer_scale': kmer_scale,
+						'kmer_max_hash': ( 2**64 - 1 ) // kmer_scale,
+						'kmer_hashes': np.zeros( 0, dtype=np.uint64 ),
+						'kmer_counts': np.zeros( 0, dtype=np.int64 ),
+						'kmer_pending': []
+					} )
+	return stats
+
+
+def add_counts( hist, values ):
+	"""! @brief add occurrences of given (flat) indices to 1D or 2D histogram array; rows are appended if necessary """
+	
+	indices, counts = np.unique( values, return_counts=True )
+	if len( indices ) == 0:
+		return hist
+	rows = int( indices[-1] ) // hist[0].size + 1
+	if rows > len( hist ):
+		hist = np.concatenate( ( hist, np.zeros( ( rows - len( hist ), ) + hist.shape[1:], dtype=hist.dtype ) ) )
+	hist.reshape( -1 )[ indices ] += counts
+	return hist
+
+
+def get_qual_bins( avg_quals ):
+	"""! @brief get index of average quality bin for each read """
+	
+	return np.clip( ( avg_quals / QUAL_BIN_SIZE ).astype( np.int64 ), 0, QUAL_BIN_NUMBER - 1 )
+
+
+def update_FASTQ_stats( stats, lines, qual_status, qual_mode="mean" ):
+	"""! @brief add lines of complete FASTQ records to statistics accumulator """
+	
+	seqs = lines[1::4]
+	lengths = np.fromiter( map( len, seqs ), dtype=np.int64, count=len( seqs ) )
+	seq_block = b"".join( seqs )
+	gc = len( seq_block ) - len( seq_block.translate( None, b"GCgc" ) )
+	if qual_status:
+		avg_quals = calc_avg_quals( lines[3::4], qual_mode )
+	else:
+		avg_quals = None
+	if 'kmer_size' in stats:
+		add_kmers_to_stats( stats, b"N".join( seqs ) )	#N prevents k-mers across reads
+	return add_reads_to_stats( stats, lengths, gc, avg_quals )
+
+
+def add_reads_to_stats( stats, lengths, gc, avg_quals ):
+	"""! @brief add read lengths, GC count and average qualities (None if not analyzed) of reads to statistics accumulator """
+	
+	stats['len_counts'] = add_counts( stats['len_counts'], lengths )
+	stats['total_gc'] += int( gc )
+	if avg_quals is not None:
+		stats['qual_sum'] += float( avg_quals.sum() )
+		flat_bins = ( lengths // LEN_BIN_SIZE ) * QUAL_BIN_NUMBER + get_qual_bins( avg_quals )
+		stats['len_qual_hist'] = add_counts( stats['len_qual_hist'], flat_bins )
+		add_to_qual_reservoir( stats, np.column_stack( ( lengths, avg_quals ) ) )
+	return stats
+
+
+def add_to_qual_reservoir( stats, values ):
+	"""! @brief update uniform random sample of (read length, average quality) rows with Algorithm R """
+	
+	read_indices = np.arange( stats['qual_reads_seen'], stats['qual_reads_seen'] + len( values ) )
+	positions = read_indices.copy()	#reservoir is filled with the first reads
+	replace = read_indices >= QUAL_RESERVOIR_SIZE
+	positions[ replace ] = stats['rng'].integers( 0, read_indices[ replace ] + 1 )
+	selected = positions < QUAL_RESERVOIR_SIZE
+	reservoir_size = min( QUAL_RESERVOIR_SIZE, stats['qual_reads_seen'] + len( values ) )
+	if reservoir_size > len( stats['qual_reservoir'] ):
+		stats['qual_reservoir'] = np.concatenate( ( stats['qual_reservoir'], np.zeros( ( reservoir_size - len( stats['qual_reservoir'] ), 2 ) ) ) )
+	stats['qual_reservoir'][ positions[ selected ] ] = values[ selected ]
+	stats['qual_reads_seen'] += len( values )
+
+
+def merge_qual_reservoirs( stats, other ):
+	"""! @brief combine random samples of two statistics into a uniform random sample of all reads """
+	
+	number = min( QUAL_RESERVOIR_SIZE, stats['qual_reads_seen'] + other['qual_reads_seen'] )
+	if other['qual_reads_seen'] == 0:
+		return
+	if stats['qual_reads_seen'] == 0:
+		from_stats = 0
+	else:
+		from_stats = stats['rng'].hypergeometric( stats['qual_reads_seen'], other['qual_reads_seen'], number )
+	stats['qual_reservoir'] = np.concatenate( (	stats['qual_reservoir'][ stats['rng'].choice( len( stats['qual_reservoir'] ), from_stats, replace=False ) ],
+												other['qual_reservoir'][ stats['rng'].choice( len( other['qual_reservoir'] ), number - from_stats, replace=False ) ]
+											) )
+	stats['qual_reads_seen'] += other['qual_reads_seen']
+
+
+def get_sampled_kmers( seq, kmer_size, max_hash ):
+	"""! @brief get hashes of all canonical k-mers (without N) of sequence that are selected by hash-based sampling (hash below max_hash) """
+	
+	codes = KMER_CODES[ np.frombuffer( seq, dtype=np.uint8 ) ]
+	number = len( codes ) - kmer_size + 1
+	if number <= 0:
+		return np.zeros( 0, dtype=np.uint64 )
+	invalid = np.concatenate( ( [ 0 ], np.cumsum( codes == 4 ) ) )
+	valid = ( invalid[ kmer_size: ] - invalid[ :-kmer_size ] ) == 0
+	codes = ( codes & 3 ).astype( np.uint64 )
+	forward = np.zeros( number, dtype=np.uint64 )
+	reverse = np.zeros( number, dtype=np.uint64 )
+	for i in range( kmer_size ):
+		forward = ( forward << np.uint64( 2 ) ) | codes[ i:i+number ]
+		reverse |= ( np.uint64( 3 ) - codes[ i:i+number ] ) << np.uint64( 2*i )
+	hashes = np.minimum( forward, reverse )[ valid ]
+	
+	# --- splitmix64 finalizer as hash function --- #
+	hashes ^= hashes >> np.uint64( 30 )
+	hashes *= np.uint64( 0xbf58476d1ce4e5b9 )
+	hashes ^= hashes >> np.uint64( 27 )
+	hashes *= np.uint64( 0x94d049bb133111eb )
+	hashes ^= hashes >> np.uint64( 31 )
+	return hashes[ hashes < np.uint64( max_hash ) ]
+
+
+def add_kmers_to_stats( stats, seq ):
+	"""! @brief count sampled k-mers of sequence; sampled k-mers are combined with the counts once enough are pending """
+	
+	for start in range( 0, len( seq ), KMER_CHUNK_SIZE ):	#chunks overlap by k-1 bases
+		stats['kmer_pending'].append( get_sampled_kmers( seq[ start:start + KMER_CHUNK_SIZE + stats['kmer_size'] - 1 ], stats['kmer_size'], stats['kmer_max_hash'] ) )
+		if sum( map( len, stats['kmer_pending'] ) ) > max( KMER_CHUNK_SIZE, len( stats['kmer_hashes'] ) ):	#merge cost stays linear in the number of sampled k-mers
+			combine_kmer_counts( stats )
+
+
+def merge_kmer_counts( hashes, counts ):
+	"""! @brief combine sorted arrays of k-mer hashes (without duplicates) and their counts into one sorted array """
+	
+	hashes, counts = np.concatenate( hashes ), np.concatenate( counts )
+	order = np.argsort( hashes, kind='stable' )	#merges the sorted runs
+	hashes, counts = hashes[ order ], counts[ order ]
+	if len( hashes ) == 0:
+		return hashes, counts
+	starts = np.flatnonzero( np.concatenate( ( [ True ], hashes[ 1: ] != hashes[ :-1 ] ) ) )
+	return hashes[ starts ], np.add.reduceat( counts, starts )
+
+
+def combine_kmer_counts( stats, other=None ):
+	"""! @brief add pending sampled k-mers (and k-mer counts of other statistics) to the sorted arrays of k-mer hashes and counts
+	
+		The table is limited to KMER_TABLE_SIZE k-mers: if it is exceeded, the hash threshold is lowered so that only the half with the smallest hashes is kept.
+		K-mers below the new threshold were always below the threshold, so their counts are complete.
+	"""
+	
+	pending_hashes, pending_counts = np.unique( np.concatenate( [ np.zeros( 0, dtype=np.uint64 ) ] + stats['kmer_pending'] ), return_counts=True )
+	stats['kmer_pending'] = []
+	hashes = [ stats['kmer_hashes'], pending_hashes ]
+	counts = [ stats['kmer_counts'], pending_counts.astype( np.int64 ) ]
+	if other is not None:
+		combine_kmer_counts( other )
+		stats['kmer_max_hash'] = min( stats['kmer_max_hash'], other['kmer_max_hash'] )
+		hashes.append( other['kmer_hashes'] )
+		counts.append( other['kmer_counts'] )
+	hashes, counts = merge_kmer_counts( hashes, counts )
+	keep = hashes < np.uint64( stats['kmer_max_hash'] )	#threshold of other statistics could be lower
+	hashes, counts = hashes[ keep ], counts[ keep ]
+	if len( hashes ) > KMER_TABLE_SIZE:
+		stats['kmer_max_hash'] = int( hashes[ KMER_TABLE_SIZE // 2 ] )
+		hashes, counts = hashes[ :KMER_TABLE_SIZE // 2 ], counts[ :KMER_TABLE_SIZE // 2 ]
+	stats['kmer_hashes'], stats['kmer_counts'] = hashes, counts
+
+
+def get_kmer_scale( stats ):
+	"""! @brief get the effective sampling scale (one of scale distinct k-mers is counted) """
+	
+	return 2.0**64 / stats['kmer_max_hash']
+
+
+def estimate_genome_size( stats ):
+	"""! @brief calculate k-mer spectrum and estimate genome size based on the coverage peak after the error valley
+	
+		@return (tuple) spectrum (estimated number of distinct k-mers per coverage), coverage peak and genome size (None if no peak was found)
+	"""
+	
+	combine_kmer_counts( stats )
+	spectrum = np.rint( np.bincount( np.minimum( stats['kmer_counts'], KMER_MAX_COVERAGE ), minlength=2 ) * get_kmer_scale( stats ) ).astype( np.int64 )
+	valley = 1
+	while valley + 1 < len( spectrum ) - 1 and spectrum[ valley + 1 ] <= spectrum[ valley ]:	#last bin collects high coverage k-mers
+		valley += 1
+	if valley + 1 >= len( spectrum ) - 1:
+		return spectrum, None, None
+	peak = valley + int( np.argmax( spectrum[ valley:-1 ] ) )
+	coverages = np.arange( len( spectrum ) )
+	genome_size = ( spectrum[ valley: ] * coverages[ valley: ] ).sum() / float( peak )
+	return spectrum, peak, int( genome_size )
+
+
+def write_kmer_stats( stats, kmer_hist_file=None ):
+	"""! @brief write k-mer based genome size estimation to stdout and k-mer spectrum to file (optional) """
+	
+	spectrum, peak, genome_size = estimate_genome_size( stats )
+	sys.stdout.write( "k-mer size: " + str( stats['kmer_size'] ) + " (sampled fraction: 1/" + str( int( round( get_kmer_scale( stats ) ) ) ) + ")\n" )
+	if genome_size is None:
+		sys.stdout.write( "WARNING: no k-mer coverage peak detected - genome size not estimated.\n" )
+	else:
+		sys.stdout.write( "k-mer coverage peak: " + str( peak ) + "\n" )
+		sys.stdout.write( "estimated genome size:\t" + str( genome_size / 1000000.0 ) + " Mbp\n" )
+	sys.stdout.flush()
+	if kmer_hist_file is not None:
+		with open( kmer_hist_file, "w" ) as out:
+			out.write( "Coverage\tKmers\n" )
+			for coverage in range( 1, len( spectrum ) ):
+				out.write( str( coverage ) + "\t" + str( spectrum[ coverage ] ) + "\n" )
+
+
+def collect_FASTQ_stats( filename, qual_status, qual_mode="mean", decompressor="auto", kmer_size=0, kmer_scale=KMER_SCALE ):
+	"""! @brief collect read length histogram, GC count and read qualities of FASTQ file
+	
+		@param decompressor (string) decompression of gzip files (see read_FASTQ_blocks)
 		
+		@param kmer_size (int) length of k-mers that are counted for genome size estimation (0: off)
+		
+		@param kmer_scale (int) only 1/kmer_scale of all distinct k-mers are counted (hash-based selection)
+		
+		@return (dictionary) statistics accumulator; 'timing' contains seconds of reading/decompression, parsing, and waiting of the parser for data
+	"""
+	
+	stats = new_FASTQ_stats( kmer_size, kmer_scale )
+	timing = {}
+	start_time = time.perf_counter()
+	for lines in iter_FASTQ_blocks( read_FASTQ_blocks( filename, decompressor, timing ) ):
+		update_FASTQ_stats( stats, lines, qual_status, qual_mode )
+	timing['parsing'] = time.perf_counter() - start_time - timing['waiting']
+	stats['timing'] = timing
+	return stats
+
+
+def write_timing( timing ):
+	"""! @brief write distribution of wall time between reading/decompression and parsing to stdout """
+	
+	sys.stdout.write( "time of reading/decompression:\t" + str( round( timing['decompression'], 3 ) ) + " s\n" )
+	sys.stdout.write( "time of parsing:\t" + str( round( timing['parsing'], 3 ) ) + " s\n" )
+	sys.stdout.write( "time of parser waiting for data:\t" + str( round( timing['waiting'], 3 ) ) + " s\n" )
+	sys.stdout.flush()
+
+
+def get_number_of_reads( stats ):
+	"""! @brief get number of reads from statistics accumulator """
+	
+	return int( stats['len_counts'].sum() )
+
+
+def get_number_of_bases( stats ):
+	"""! @brief get number of bases from statistics accumulator """
+	
+	return int( ( stats['len_counts'] * np.arange( len( stats['len_counts'] ) ) ).sum() )
+
+
+def write_FASTQ_stats( filename, stats, qual_status ):
+	"""! @brief write statistics of one FASTQ file to stdout """
+	
+	number_of_reads = get_number_of_reads( stats )
+	total_len = get_number_of_bases( stats )
+	n50 = calculate_n50( stats['len_counts'] )
+	
+	sys.stdout.write( filename + "\n" )
+	sys.stdout.write( "total number of nucleotides:\t" + str( total_len / 1000000000.0 ) + " Gbp\n" )
+	sys.stdout.write( "N50: " + str( n50 ) + "\n" )
+	sys.stdout.write( "number of reads: " + str( number_of_reads ) + "\n" )
+	
+	sys.stdout.write( "average read length:\t" + str( total_len / float( number_of_reads ) ) + "\n" )
+	sys.stdout.write( "GC content:\t" + str( stats['total_gc'] / float( total_len ) ) + "\n" )
+	
+	if qual_status:
+		if number_of_reads > 0:
+			sum_avg_qual = stats['qual_sum'] / number_of_reads
+		else:
+			sum_avg_qual = 0
+		sys.stdout.write( "average read quality score: " + str( sum_avg_qual ) + "\n" )
+	
+	sys.stdout.flush()
+
+
+def analyze_FASTQ( filename, qual_status, qual_mode="mean", decompressor="auto", timing_status=False, kmer_size=0, kmer_scale=KMER_SCALE ):
+	"""! @brief analysis of FASTQ file """
+	
+	stats = collect_FASTQ_stats( filename, qual_status, qual_mode, decompressor, kmer_size, kmer_scale )
+	write_FASTQ_stats( filename, stats, qual_status )
+	if timing_status:
+		write_timing( stats['timing'] )
+	return stats
+
+
+def merge_FASTQ_stats( stats, other ):
+	"""! @brief add statistics of another FASTQ file to given statistics """
+	
+	for key in [ 'len_counts', 'len_qual_hist' ]:
+		if len( other[ key ] ) > len( stats[ key ] ):
+			stats[ key ], other_hist = other[ key ].copy(), stats[ key ]
+		else:
+			other_hist = other[ key ]
+		stats[ key ][ :len( other_hist ) ] += other_hist
+	stats['total_gc'] += other['total_gc']
+	stats['qual_sum'] += other['qual_sum']
+	merge_qual_reservoirs( stats, other )
+	if 'kmer_size' in stats and 'kmer_size' in other:
+		combine_kmer_counts( stats, other )
+	return stats
+
+
+def save_FASTQ_stats( stats, summary_file, qual_mode ):
+	"""! @brief write compact summary of statistics accumulator to file (NumPy .npz)
+	
+		@param summary_file (string or binary file object) summary output file
+		
+		@param qual_mode (string) quality mode of the average read qualities; None if qualities were not analyzed
+	"""
+	
+	if isinstance( summary_file, str ):
+		with open( summary_file, "wb" ) as out:	#file handle prevents the automatic .npz extension
+			save_FASTQ_stats( stats, out, qual_mode )
 	else:
-		with gzip.open( filename, "rb" ) as f:
-			total_length = []
-			average_quality = []
-			total_GC = []
-			line = f.readline().decode("utf-8")	#header
-			while line:
-				seq = f.readline().decode("utf-8").strip().upper()
-				total_length.append( len( seq ) )
-				total_GC.append( seq.count('C') )
-				total_GC.append( seq.count('G') )
-				f.readline()	#useless line
-				qual = f.readline().decode("utf-8")	#quality line
-				if qual_status:
-					average_quality.append( calc_avg_qual( qual ) )
-				line = f.readline().decode("utf-8")
-			
-			total_len = sum( total_length )
-			total_gc = sum( total_GC )
-			n50 = calculate_n50( total_length )
-			
-			sys.stdout.write( filename + "\n" )
-			sys.stdout.write( "total number of nucleotides:\t" + str( total_len / 1000000000.0 ) + " Gbp\n" )
-			sys.stdout.write( "N50: " + str( n50 ) + "\n" )
-			sys.stdout.write( "number of reads: " + str( len( total_length ) ) + "\n" )
+		np.savez_compressed(	summary_file,
+								len_counts=stats['len_counts'],
+								len_qual_hist=stats['len_qual_hist'],
+								total_gc=np.int64( stats['total_gc'] ),
+								qual_sum=np.float64( stats['qual_sum'] ),
+								qual_reservoir=stats['qual_reservoir'],
+								qual_reads_seen=np.int64( stats['qual_reads_seen'] ),
+								qual_mode=np.str_( qual_mode or "" ),
+								version=np.str_( __version__ )
+							)
+
+
+def load_FASTQ_stats( summary_file ):
+	"""! @brief load statistics accumulator from summary file
+	
+		@return (tuple) statistics accumulator and quality mode (None if qualities were not analyzed)
+	"""
+	
+	with np.load( summary_file, allow_pickle=False ) as data:
+		stats = {	'len_counts': data['len_counts'],
+					'total_gc': int( data['total_gc'] ),
+					'qual_sum': float( data['qual_sum'] ),
+					'len_qual_hist': data['len_qual_hist'],
+					'qual_reservoir': np.zeros( ( 0, 2 ) ),
+					'qual_reads_seen': 0,
+					'rng': np.random.default_rng( RESERVOIR_SEED )
+				}
+		if 'qual_reservoir' in data.files:	#not available in summaries of older versions
+			stats['qual_reservoir'] = data['qual_reservoir']
+			stats['qual_reads_seen'] = int( data['qual_reads_seen'] )
+		qual_mode = str( data['qual_mode'] ) or None
+	if stats['len_qual_hist'].shape[1:] != ( QUAL_BIN_NUMBER, ):
+		raise ValueError( "incompatible quality bins in summary " + str( summary_file ) )
+	return stats, qual_mode
+
+
+def merge_FASTQ_summaries( summary_files ):
+	"""! @brief combine statistics of several summary files without reading any FASTQ file
+	
+		@return (tuple) merged statistics accumulator and quality mode (None if not all summaries contain qualities of the same mode)
+	"""
+	
+	total_stats, total_qual_mode = load_FASTQ_stats( summary_files[0] )
+	qual_modes = set( [ total_qual_mode ] )
+	for summary_file in summary_files[1:]:
+		stats, qual_mode = load_FASTQ_stats( summary_file )
+		qual_modes.add( qual_mode )
+		total_stats = merge_FASTQ_stats( total_stats, stats )
+	if len( qual_modes ) > 1:
+		sys.stdout.write( "WARNING: summaries with different quality modes - quality is not reported.\n" )
+		sys.stdout.flush()
+		total_qual_mode = None
+	return total_stats, total_qual_mode
+
+
+def get_summary_file( summary_dir, filename ):
+	"""! @brief get name of the summary file of given FASTQ file in summary folder """
+	
+	if summary_dir[-1] != '/':
+		summary_dir += "/"
+	return summary_dir + filename.split('/')[-1] + ".stats.npz"
+
+
+def open_stats_cache( cache_file ):
+	"""! @brief open (and create) SQLite database that caches the statistics of FASTQ files """
+	
+	cache = sqlite3.connect( cache_file )
+	cache.execute( """CREATE TABLE IF NOT EXISTS stats (
+						path TEXT NOT NULL,
+						qual_mode TEXT NOT NULL,
+						size INTEGER NOT NULL,
+						mtime_ns INTEGER NOT NULL,
+						content_hash TEXT NOT NULL,
+						summary BLOB NOT NULL,
+						last_used REAL NOT NULL,
+						PRIMARY KEY ( path, qual_mode ) )""" )
+	cache.commit()
+	return cache
+
+
+def get_file_identity( filename, content_hash ):
+	"""! @brief get size, modification time and (optional) BLAKE2 content hash of file """
+	
+	file_hash = ""
+	if content_hash:
+		file_hash = hashlib.blake2b()
+		with open( filename, "rb" ) as f:
+			block = f.read( BLOCK_SIZE )
+			while block:
+				file_hash.update( block )
+				block = f.read( BLOCK_SIZE )
+		file_hash = file_hash.hexdigest()
+	info = os.stat( filename )
+	return info.st_size, info.st_mtime_ns, file_hash
+
+
+def lookup_cached_stats( cache, filename, qual_key, content_hash ):
+	"""! @brief get cached statistics of FASTQ file if size, modification time and (optional) content hash are unchanged
+	
+		@param qual_key (string) quality mode or empty string if qualities are not analyzed
+		
+		@return (tuple) statistics accumulator (None if not cached) and current identity of the file
+	"""
+	
+	path = os.path.abspath( filename )
+	identity = get_file_identity( filename, content_hash )
+	row = cache.execute( "SELECT size, mtime_ns, content_hash, summary FROM stats WHERE path=? AND qual_mode=?", ( path, qual_key ) ).fetchone()
+	if row is None or tuple( row[:2] ) != identity[:2] or ( content_hash and row[2] != identity[2] ):
+		return None, identity
+	cache.execute( "UPDATE stats SET last_used=? WHERE path=? AND qual_mode=?", ( time.time(), path, qual_key ) )
+	cache.commit()
+	return load_FASTQ_stats( io.BytesIO( row[3] ) )[0], identity
+
+
+def store_cached_stats( cache, filename, qual_key, identity, stats ):
+	"""! @brief add statistics of FASTQ file with given identity (size, modification time, content hash) to cache """
+	
+	summary = io.BytesIO()
+	save_FASTQ_stats( stats, summary, qual_key or None )
+	cache.execute( "INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?, ?, ?)", ( os.path.abspath( filename ), qual_key ) + tuple( identity ) + ( summary.getvalue(), time.time() ) )
+	cache.commit()
+
+
+def evict_cached_stats( cache, max_cache_size ):
+	"""! @brief remove least recently used entries until the cached summaries are smaller than given number of bytes """
+	
+	cache_size = cache.execute( "SELECT COALESCE( SUM( LENGTH( summary ) ), 0 ) FROM stats" ).fetchone()[0]
+	if cache_size > max_cache_size:
+		for path, qual_key, summary_size in cache.execute( "SELECT path, qual_mode, LENGTH( summary ) FROM stats ORDER BY last_used" ).fetchall():
+			cache.execute( "DELETE FROM stats WHERE path=? AND qual_mode=?", ( path, qual_key ) )
+			cache_size -= summary_size
+			if cache_size <= max_cache_size:
+				break
+		cache.commit()
+		cache.execute( "VACUUM" )
+
+
+def get_FASTQ_files( directory ):
+	"""! @brief get sorted list of all FASTQ files in given directory """
+	
+	if directory[-1] != '/':
+		directory += "/"
+	input_files = []
+	extensions = [ ".fq", ".fastq", ".fq.gzip", ".fastq.gzip", ".fq.gz", ".fastq.gz", ".FQ", ".FASTQ", ".FQ.GZIP", ".FASTQ.GZIP", ".FQ.GZ", ".FASTQ.GZ" ]
+	for extension in extensions:
+		input_files += glob.glob( directory + '*' + extension )
+	return sorted( set( input_files ) )
+
+
+def analyze_FASTQ_files( input_files, qual_status, qual_mode, threads, summary_dir=None, cache=None, content_hash=False, decompressor="auto", timing_status=False, kmer_size=0, kmer_scale=KMER_SCALE ):
+	"""! @brief analyze FASTQ files in a process pool and report statistics per file (in input order) and in total
+	
+		@param input_files (list) FASTQ files
+		
+		@param threads (int) number of worker processes; files are analyzed one after the other if 1
+		
+		@param summary_dir (string) folder for summary files of all analyzed FASTQ files (optional)
+		
+		@param cache (sqlite3 connection) statistics cache; only new or modified files are analyzed (optional)
+		
+		@param content_hash (bool) compare content hash in addition to size and modification time of cached files
+		
+		@param decompressor (string) decompression of gzip files (see read_FASTQ_blocks)
+		
+		@param timing_status (bool) report time of reading/decompression and parsing per analyzed file
+		
+		@param kmer_size (int) length of k-mers for genome size estimation (0: off; see collect_FASTQ_stats)
+		
+		@return (dictionary) merged statistics of all successfully analyzed files (None if no file was analyzed)
+	"""
+	
+	qual_key = qual_mode if qual_status else ""
+	cached_stats, identities = {}, {}
+	if cache is not None:
+		for filename in input_files:
+			try:
+				stats, identities[ filename ] = lookup_cached_stats( cache, filename, qual_key, content_hash )
+			except OSError:	#reported when the file is analyzed
+				continue
+			if stats is not None:
+				cached_stats[ filename ] = stats
+	
+	if threads > 1:
+		executor = concurrent.futures.ProcessPoolExecutor( max_workers=threads )
+		futures = {}
+		for filename in input_files:
+			if filename not in cached_stats:
+				futures[ filename ] = executor.submit( collect_FASTQ_stats, filename, qual_status, qual_mode, decompressor, kmer_size, kmer_scale )
+	
+	total_stats = None
+	analyzed_files = 0
+	for filename in input_files:
+		try:
+			if filename in cached_stats:
+				stats = cached_stats.pop( filename )
+			else:
+				if threads > 1:
+					stats = futures.pop( filename ).result()
+				else:
+					stats = collect_FASTQ_stats( filename, qual_status, qual_mode, decompressor, kmer_size, kmer_scale )
+				if cache is not None and filename in identities:
+					store_cached_stats( cache, filename, qual_key, identities[ filename ], stats )
+			if get_number_of_reads( stats ) == 0:
+				raise ValueError( "no reads detected" )
+		except Exception as error:
+			sys.stdout.write( "ERROR while processing " + filename + ": " + str( error ) + "\n" )
+			sys.stdout.flush()
+			continue
+		write_FASTQ_stats( filename, stats, qual_status )
+		if timing_status and 'timing' in stats:	#not available for cached files
+			write_timing( stats['timing'] )
+		if summary_dir is not None:
+			save_FASTQ_stats( stats, get_summary_file( summary_dir, filename ), qual_mode if qual_status else None )
+		analyzed_files += 1
+		if total_stats is None:
+			total_stats = stats
+		else:
+			total_stats = merge_FASTQ_stats( total_stats, stats )
+	
+	if threads > 1:
+		executor.shutdown()
+	if analyzed_files > 1:
+		sys.stdout.write( "\n" )
+		write_FASTQ_stats( "total (" + str( analyzed_files ) + " files)", total_stats, qual_status )
+	return total_stats
+
+
+def sample_FASTQ( filename, qual_status, qual_mode, sample_mode, sample_size, seed=1 ):
+	"""! @brief collect read lengths, GC counts and qualities of a subset of reads of FASTQ file
+	
+		@param sample_mode (string) "reservoir" (random sample of sample_size reads), "every" (every sample_size-th read), "time" (first sample_size seconds) or "bytes" (first sample_size bytes of the file)
+		
+		@return (dictionary) per-read values of the sampled reads, number of reads and bases seen, and fraction of the (compressed) file that was read
+	"""
+	
+	rng = np.random.default_rng( seed )
+	sample = { 'lengths': [], 'gc': [], 'quals': [], 'reads_seen': 0, 'bases_seen': 0, 'fraction': 1.0 }
+	if sample_mode == "reservoir":
+		reservoir_lengths = np.zeros( int( sample_size ), dtype=np.int64 )
+		reservoir_gc = np.zeros( int( sample_size ), dtype=np.int64 )
+		reservoir_quals = np.zeros( int( sample_size ), dtype=np.float64 )
+	
+	file_size = os.path.getsize( filename )
+	start_time = time.time()
+	with open( filename, "rb" ) as raw:
+		if is_gzip_file( filename ):
+			handle = gzip.GzipFile( fileobj=raw )
+		else:
+			handle = raw
+		
+		def read_blocks():
+			"""! @brief yield blocks of the file; in bytes mode the reading stops at the byte budget (compressed offset for gzip files) """
+			while sample_mode != "bytes" or raw.tell() < sample_size:
+				if sample_mode != "bytes":
+					block = handle.read( BLOCK_SIZE )
+				elif handle is raw:
+					block = handle.read( min( BLOCK_SIZE, int( sample_size ) - raw.tell() ) )
+				else:
+					block = handle.read( SAMPLE_GZIP_READ_SIZE )
+				if len( block ) == 0:
+					break
+				yield block
+		
+		truncated = sample_mode == "bytes" and sample_size < file_size	#record at the byte budget is incomplete
+		for lines in iter_FASTQ_blocks( read_blocks(), truncated ):
+			seqs = lines[1::4]
+			lengths = np.fromiter( map( len, seqs ), dtype=np.int64, count=len( seqs ) )
+			read_indices = np.arange( sample['reads_seen'], sample['reads_seen'] + len( seqs ) )
 			
-			sys.stdout.write( "average read length:\t" + str( total_len / float( len( total_length ) ) ) + "\n" )
-			sys.stdout.write( "GC content:\t" + str( total_gc / float( total_len ) ) + "\n" )
+			# --- select reads of this block (and their positions in the reservoir) --- #
+			if sample_mode == "reservoir":
+				positions = read_indices.copy()	#reservoir is filled with the first reads
+				replace = read_indices >= sample_size
+				positions[ replace ] = rng.integers( 0, read_indices[ replace ] + 1 )	#Algorithm R
+				selected = np.nonzero( positions < sample_size )[0]
+			elif sample_mode == "every":
+				selected = np.nonzero( read_indices % int( sample_size ) == 0 )[0]
+			else:
+				selected = np.arange( len( seqs ) )
 			
+			selected_lengths = lengths[ selected ]
+			selected_gc = np.fromiter( ( len( seqs[ i ] ) - len( seqs[ i ].translate( None, b"GCgc" ) ) for i in selected ), dtype=np.int64, count=len( selected ) )
 			if qual_status:
-				if len( average_quality ) > 0:
-					sum_avg_qual = sum( average_quality ) / len( average_quality )
-				else:
-					sum_avg_qual = 0
-				sys.stdout.write( "average read quality score: " + str( sum_avg_qual ) + "\n" )
+				selected_quals = calc_avg_quals( [ lines[ 4*i+3 ] for i in selected ], qual_mode )
+			else:
+				selected_quals = np.zeros( len( selected ) )
+			if sample_mode == "reservoir":
+				reservoir_lengths[ positions[ selected ] ] = selected_lengths
+				reservoir_gc[ positions[ selected ] ] = selected_gc
+				reservoir_quals[ positions[ selected ] ] = selected_quals
+			else:
+				sample['lengths'].append( selected_lengths )
+				sample['gc'].append( selected_gc )
+				sample['quals'].append( selected_quals )
 			
-			sys.stdout.flush()
-	return total_length, average_quality
+			sample['reads_seen'] += len( seqs )
+			sample['bases_seen'] += int( lengths.sum() )
+			if sample_mode == "time" and time.time() - start_time >= sample_size:
+				sample['fraction'] = min( 1.0, raw.tell() / float( max( file_size, 1 ) ) )	#compressed offset for gzip files
+				break
+		if truncated:
+			sample['fraction'] = min( 1.0, raw.tell() / float( max( file_size, 1 ) ) )
+	
+	if sample_mode == "reservoir":
+		number = min( sample['reads_seen'], int( sample_size ) )
+		sample['lengths'], sample['gc'], sample['quals'] = reservoir_lengths[ :number ], reservoir_gc[ :number ], reservoir_quals[ :number ]
+	else:
+		for key in [ 'lengths', 'gc', 'quals' ]:
+			sample[ key ] = np.concatenate( sample[ key ] + [ np.zeros( 0 ) ] ).astype( np.float64 if key == 'quals' else np.int64 )
+	return sample
+
+
+def calculate_n50_of_lengths( lengths ):
+	"""! @brief calculate N50 of given array of read lengths """
+	
+	sorted_lengths = np.sort( lengths )[::-1]
+	cum_lengths = np.cumsum( sorted_lengths )
+	return int( sorted_lengths[ np.searchsorted( cum_lengths, cum_lengths[-1] / 2.0 ) ] )
+
+
+def write_sample_estimates( filename, sample, qual_status, sample_label, seed=1 ):
+	"""! @brief write estimates of FASTQ statistics with 95% confidence intervals based on sampled reads to stdout
+	
+		Confidence intervals of means are based on the normal approximation, confidence intervals of N50 and GC content on bootstrapping of the sampled reads.
+	"""
+	
+	lengths, gc, quals = sample['lengths'], sample['gc'], sample['quals']
+	number_of_reads = len( lengths )
+	if number_of_reads == 0 or lengths.sum() == 0:
+		sys.exit( "ERROR: no read lengths detected." )
+	
+	def format_estimate( value, ci ):
+		return str( value ) + " (95% CI: " + str( ci[0] ) + " - " + str( ci[1] ) + ")"
+	
+	def normal_ci( values ):
+		margin = 1.96 * values.std( ddof=1 ) / np.sqrt( len( values ) ) if len( values ) > 1 else 0.0
+		return values.mean() - margin, values.mean() + margin
+	
+	# --- bootstrap of N50 and GC content: all rounds of a batch are resampled and sorted as one 2-D array --- #
+	draws = min( number_of_reads, BOOTSTRAP_MAX_DRAWS )
+	batch_rounds = max( 1, min( BOOTSTRAP_ROUNDS, BOOTSTRAP_BATCH_SIZE // draws ) )
+	rng = np.random.default_rng( seed )
+	boot_n50, boot_gc = [], []
+	for start in range( 0, BOOTSTRAP_ROUNDS, batch_rounds ):
+		rounds = min( batch_rounds, BOOTSTRAP_ROUNDS - start )
+		indices = rng.integers( 0, number_of_reads, ( rounds, draws ) )
+		boot_lengths = np.sort( lengths[ indices ], axis=1 )[ :, ::-1 ]
+		cum_lengths = np.cumsum( boot_lengths, axis=1 )
+		boot_n50.extend( boot_lengths[ np.arange( rounds ), ( cum_lengths < cum_lengths[ :, -1: ] / 2.0 ).sum( axis=1 ) ] )
+		boot_gc.extend( gc[ indices ].sum( axis=1 ) / np.maximum( cum_lengths[ :, -1 ], 1 ).astype( np.float64 ) )
+	
+	def bootstrap_ci( estimate, values ):
+		ci = np.percentile( values, [ 2.5, 97.5 ] )
+		if draws < number_of_reads:	#m-out-of-n bootstrap: deviations shrink with the square root of the number of reads
+			ci = estimate + ( ci - estimate ) * np.sqrt( draws / float( number_of_reads ) )
+		return ci
+	
+	# --- extrapolation of read number and yield (early stop) --- #
+	estimated_reads = sample['reads_seen'] / sample['fraction']
+	mean_len_ci = normal_ci( lengths.astype( np.float64 ) )
+	if sample['fraction'] < 1.0:
+		estimated_bases = sample['bases_seen'] / sample['fraction']
+		yield_ci = ( estimated_reads * mean_len_ci[0] / 1000000000.0, estimated_reads * mean_len_ci[1] / 1000000000.0 )
+	else:
+		estimated_bases = sample['bases_seen']
+		yield_ci = ( estimated_bases / 1000000000.0, estimated_bases / 1000000000.0 )
+	
+	sys.stdout.write( filename + " (sample: " + sample_label + ")\n" )
+	sys.stdout.write( "fraction of file read:\t" + str( sample['fraction'] ) + "\n" )
+	sys.stdout.write( "number of sampled reads: " + str( number_of_reads ) + "\n" )
+	sys.stdout.write( "estimated number of reads: " + str( int( round( estimated_reads ) ) ) + "\n" )
+	sys.stdout.write( "estimated total number of nucleotides:\t" + format_estimate( estimated_bases / 1000000000.0, yield_ci ) + " Gbp\n" )
+	n50 = calculate_n50_of_lengths( lengths )
+	sys.stdout.write( "estimated N50: " + format_estimate( n50, bootstrap_ci( n50, boot_n50 ) ) + "\n" )
+	sys.stdout.write( "average read length:\t" + format_estimate( lengths.mean(), mean_len_ci ) + "\n" )
+	gc_content = gc.sum() / float( lengths.sum() )
+	sys.stdout.write( "GC content:\t" + format_estimate( gc_content, bootstrap_ci( gc_content, boot_gc ) ) + "\n" )
+	if qual_status:
+		sys.stdout.write( "average read quality score: " + format_estimate( quals.mean(), normal_ci( quals ) ) + "\n" )
+	sys.stdout.flush()
 
 
-def generate_read_len_hist( total_length, fig_file, len_cutoff ):
+def new_follow_state( filename ):
+	"""! @brief create state of a followed FASTQ file: read offset, bytes of incomplete last record, gzip decompressor, and statistics """
+	
+	if is_gzip_file( filename ):
+		decompressor = zlib.decompressobj( 16 + zlib.MAX_WBITS )
+	else:
+		decompressor = None
+	return { 'offset': 0, 'rest': b"", 'decompressor': decompressor, 'stats': new_FASTQ_stats() }
+
+
+def follow_FASTQ_file( state, filename, qual_status, qual_mode ):
+	"""! @brief parse only the bytes appended to FASTQ file since the last call; incomplete last records are kept for the next call
+	
+		@return (bool) True if new data was found
+	"""
+	
+	if os.path.getsize( filename ) < state['offset']:	#file was replaced
+		sys.stdout.write( "WARNING: " + filename + " became smaller - statistics are collected again.\n" )
+		sys.stdout.flush()
+		state.update( new_follow_state( filename ) )
+	new_data = False
+	with open( filename, "rb" ) as f:
+		f.seek( state['offset'] )
+		block = f.read( BLOCK_SIZE )
+		while block:
+			new_data = True
+			state['offset'] += len( block )
+			if state['decompressor'] is not None:
+				block = decompress_gzip_block( state, block )
+			lines, state['rest'] = split_FASTQ_block( state['rest'] + block )
+			if len( lines ) > 0:
+				update_FASTQ_stats( state['stats'], lines, qual_status, qual_mode )
+			block = f.read( BLOCK_SIZE )
+	return new_data
+
+
+def finish_follow_state( state, qual_status, qual_mode ):
+	"""! @brief add last record without line break at the end of a followed file """
+	
+	rest = state['rest'].rstrip()
+	if len( rest ) > 0:
+		lines, state['rest'] = split_FASTQ_block( rest + b"\n" )
+		if len( lines ) > 0:
+			update_FASTQ_stats( state['stats'], lines, qual_status, qual_mode )
+
+
+def follow_FASTQ_files( get_input_files, qual_status, qual_mode, interval, max_idle_time, arguments ):
+	"""! @brief monitor FASTQ files that are still being written and report running statistics at a fixed interval
+	
+		@param get_input_files (function) returns the current list of FASTQ files
+		
+		@param interval (float) seconds between two updates
+		
+		@param max_idle_time (float) stop if no new data appeared for this number of seconds (None: run until interrupted)
+		
+		@param arguments (list) command line arguments for the generation of figures
+	"""
+	
+	states = {}
+	last_new_data = time.time()
+	try:
+		while True:
+			new_data = False
+			for filename in get_input_files():
+				if filename not in states:
+					states[ filename ] = new_follow_state( filename )
+				try:
+					if follow_FASTQ_file( states[ filename ], filename, qual_status, qual_mode ):
+						new_data = True
+				except ( OSError, EOFError, zlib.error ) as error:
+					sys.stdout.write( "ERROR while processing " + filename + ": " + str( error ) + "\n" )
+					sys.stdout.flush()
+			if new_data:
+				last_new_data = time.time()
+				report_followed_files( states, qual_status, arguments )
+			elif max_idle_time is not None and time.time() - last_new_data >= max_idle_time:
+				break
+			time.sleep( interval )
+	except KeyboardInterrupt:
+		pass
+	for state in states.values():
+		finish_follow_state( state, qual_status, qual_mode )
+	report_followed_files( states, qual_status, arguments )
+
+
+def report_followed_files( states, qual_status, arguments ):
+	"""! @brief write running statistics of all followed files to stdout and update figures """
+	
+	stats = new_FASTQ_stats()
+	for state in states.values():
+		stats = merge_FASTQ_stats( stats, state['stats'] )
+	if get_number_of_reads( stats ) > 0:
+		write_FASTQ_stats( time.strftime( "%Y-%m-%d %H:%M:%S" ) + " (" + str( len( states ) ) + " files)", stats, qual_status )
+		generate_figures( stats, arguments )
+		sys.stdout.write( "\n" )
+		sys.stdout.flush()
+
+
+def import_plotting_modules():
+	"""! @brief import plotting modules (only when figures are generated to keep the start of the script fast) """
+	
+	global plt, ticker, pd, sns
+	try:
+		import matplotlib.pyplot as plt
+		import matplotlib.ticker as ticker
+		import pandas as pd
+		import seaborn as sns
+	except ImportError:
+		sys.exit( "ERROR: matplotlib, pandas and seaborn are required for figure plotting." )
+
+
+def generate_read_len_hist( len_counts, fig_file, len_cutoff ):
 	"""! @brief generate histogram of read length distribution """
 	
+	import_plotting_modules()
+	
 	# --- preprocess data --- #
-	bins = []
-	for i in range( len_cutoff ):
-		bins.append( [] )
-	for length in total_length:
-		if length > (len_cutoff*1000):
-			bins[-1].append( length )
-		else:
-			bins[ int( length/1000.0 ) ].append( length )
+	read_lengths = np.arange( len( len_counts ) )
+	bins = np.bincount( np.minimum( read_lengths // 1000, len_cutoff-1 ), weights=len_counts * read_lengths, minlength=len_cutoff )
 	df_input = []
 	labels = []
 	for idx, each in enumerate( bins ):
-		df_input.append( [ str( idx ) + "-" + str(idx+1) + "kb", sum( each ) / 1000000.0 ] )
+		df_input.append( [ str( idx ) + "-" + str(idx+1) + "kb", each / 1000000.0 ] )
 		labels.append( str( idx ) + "-" + str(idx+1) + "kb" )
 	df = pd.DataFrame( data=df_input, index=labels, columns=["label", "value"] )
 	
@@ -179,25 +1111,42 @@ def generate_read_len_hist( total_length, fig_file, len_cutoff ):
 	plt.tight_layout()
 	
 	fig.savefig( fig_file, dpi=300 )
+	plt.close( fig )
 
 
-def generate_quality_vs_read_len_figure( total_length, average_quality, figfile, max_qual_cut, max_len_cut ):
-	"""! @brief generate quality vs. read length figure """
+def generate_quality_vs_read_len_figure( len_qual_hist, qual_reservoir, figfile, max_qual_cut, max_len_cut ):
+	"""! @brief generate quality vs. read length figure; the density is drawn from the binned reads and scatter/KDE layers from a random sample, thus the time does not depend on the number of reads
 	
-	xvalues, yvalues = [], []
-	for idx, val in enumerate( average_quality ):
-		xvalues.append( min( [ total_length[ idx ] / 1000.0, max_len_cut ] ) )	#unit is kb
-		yvalues.append( min( [ val, max_qual_cut ] ) )
+		@param len_qual_hist (numpy array) number of reads per read length bin (rows) and average quality bin (columns)
+		
+		@param qual_reservoir (numpy array) random sample of reads (rows: read length, average quality)
+	"""
+	
+	import_plotting_modules()
+	
+	# --- collect bins beyond the cutoffs in the last bin (like the values of the sampled reads) --- #
+	len_bin_number = int( max_len_cut * 1000 / LEN_BIN_SIZE ) + 1
+	qual_bin_number = min( int( max_qual_cut / QUAL_BIN_SIZE ) + 1, QUAL_BIN_NUMBER )
+	binned_reads = np.zeros( ( len_bin_number, qual_bin_number ), dtype=np.int64 )
+	len_indices = np.minimum( np.arange( len( len_qual_hist ) ), len_bin_number - 1 )
+	qual_indices = np.minimum( np.arange( QUAL_BIN_NUMBER ), qual_bin_number - 1 )
+	np.add.at( binned_reads, ( len_indices[ :, None ], qual_indices[ None, : ] ), len_qual_hist )
+	
+	xvalues = np.minimum( qual_reservoir[ :, 0 ] / 1000.0, max_len_cut )	#unit is kb
+	yvalues = np.minimum( qual_reservoir[ :, 1 ], max_qual_cut )
 	
 	sns.set_theme(style="dark")
 	fig, ax = plt.subplots()
+	ax.pcolormesh(	np.arange( len_bin_number + 1 ) * LEN_BIN_SIZE / 1000.0,
+					np.arange( qual_bin_number + 1 ) * QUAL_BIN_SIZE,
+					np.ma.masked_equal( binned_reads.T, 0 ), cmap="Greens" )	#cmap="mako"
 	sns.scatterplot(x=xvalues, y=yvalues, s=5, color=".15")
-	sns.histplot(x=xvalues, y=yvalues, bins=100, pthresh=.1, cmap="Greens")	#cmap="mako"
-	sns.kdeplot(x=xvalues, y=yvalues, levels=5, color="r", linewidths=1)
+	if len( xvalues ) > 2:
+		sns.kdeplot(x=xvalues, y=yvalues, levels=5, color="r", linewidths=1)
 	
 	ax.set_xlabel( "read length [kb]" )
 	ax.set_ylabel( "quality (Phred score)" )
-	ax.set_title( "number of reads: " + str( len( xvalues ) ) )
+	ax.set_title( "number of reads: " + str( int( len_qual_hist.sum() ) ) )
 	
 	ax.set_xlim( 0, max_len_cut+1 )
 	ax.set_ylim( 0, max_qual_cut+1 )
@@ -205,6 +1154,32 @@ def generate_quality_vs_read_len_figure( total_length, average_quality, figfile,
 	plt.tight_layout()
 	
 	fig.savefig( figfile, dpi=300 )
+	plt.close( fig )
+
+
+def generate_figures( stats, arguments ):
+	"""! @brief generate figures requested via command line arguments """
+	
+	if '--rfig' in arguments:
+		read_len_fig_file = arguments[ arguments.index( '--rfig' )+1 ]
+		if '--cutoff' in arguments:
+			len_cutoff = int( arguments[ arguments.index( '--cutoff' )+1 ] )
+		else:
+			len_cutoff = 100
+		generate_read_len_hist( stats['len_counts'], read_len_fig_file, len_cutoff )
+	if '--qfig' in arguments:
+		quality_vs_read_len_fig_file = arguments[ arguments.index( '--qfig' )+1 ]
+		
+		if '--qualcut' in arguments:
+			max_qual_cut = int( arguments[ arguments.index( '--qualcut' )+1 ] )
+		else:
+			max_qual_cut = 40
+		if '--lencut' in arguments:
+			max_len_cut = int( arguments[ arguments.index( '--lencut' )+1 ] )
+		else:
+			max_len_cut = 200
+		
+		generate_quality_vs_read_len_figure( stats['len_qual_hist'], stats['qual_reservoir'], quality_vs_read_len_fig_file, max_qual_cut, max_len_cut )
 
 
 def main( arguments ):
@@ -213,56 +1188,151 @@ def main( arguments ):
 	if '--qfig' in arguments:
 		qual_status = True
 	else:
-		if '--quality' in arguments:
+		if '--quality' in arguments or '--qualmode' in arguments:
 			qual_status = True
 		else:
 			qual_status = False
 	
-	if '--in_file' in arguments or '--in' in arguments:	#single file mode
+	if '--qualmode' in arguments:
+		qual_mode = arguments[ arguments.index( '--qualmode' )+1 ]
+		if qual_mode not in [ "mean", "error" ]:
+			sys.exit( "ERROR: --qualmode must be 'mean' or 'error'." )
+	else:
+		qual_mode = "mean"
+	
+	if arguments[1:2] == [ 'plot' ]:	#figures based on summary files
+		if '--summary' not in arguments or ( '--rfig' not in arguments and '--qfig' not in arguments ):
+			sys.exit( "ERROR: plot requires --summary <SUMMARY_FILE1,SUMMARY_FILE2,...> and --rfig and/or --qfig." )
+		stats, merged_qual_mode = merge_FASTQ_summaries( arguments[ arguments.index( '--summary' )+1 ].split(',') )
+		if '--qfig' in arguments and merged_qual_mode is None:
+			sys.exit( "ERROR: summaries do not contain (consistent) read qualities for --qfig." )
+		generate_figures( stats, arguments )
+		return
+	
+	if '--decompressor' in arguments:
+		decompressor = arguments[ arguments.index( '--decompressor' )+1 ]
+		if decompressor not in [ "auto", "python", "pigz", "igzip" ]:
+			sys.exit( "ERROR: --decompressor must be 'auto', 'python', 'pigz' or 'igzip'." )
+		if decompressor in [ "pigz", "igzip" ] and not shutil.which( decompressor ):
+			sys.exit( "ERROR: " + decompressor + " not found." )
+	else:
+		decompressor = "auto"
+	
+	if '--kmer' in arguments:
+		kmer_size = int( arguments[ arguments.index( '--kmer' )+1 ] )
+		if kmer_size < 1 or kmer_size > 32:
+			sys.exit( "ERROR: --kmer must be between 1 and 32." )
+	else:
+		kmer_size = 0
+	if '--kmer_scale' in arguments:
+		kmer_scale = int( arguments[ arguments.index( '--kmer_scale' )+1 ] )
+		if kmer_scale < 1:
+			sys.exit( "ERROR: --kmer_scale must be a positive integer." )
+	else:
+		kmer_scale = KMER_SCALE
+	if '--kmer_hist' in arguments:
+		kmer_hist_file = arguments[ arguments.index( '--kmer_hist' )+1 ]
+	else:
+		kmer_hist_file = None
+	
+	if '--follow' in arguments:	#monitoring of files that are still being written
+		if '--interval' in arguments:
+			interval = float( arguments[ arguments.index( '--interval' )+1 ] )
+		else:
+			interval = 60
+		if '--follow_stop' in arguments:
+			max_idle_time = float( arguments[ arguments.index( '--follow_stop' )+1 ] )
+		else:
+			max_idle_time = None
+		if '--in_dir' in arguments:
+			directory = arguments[ arguments.index( '--in_dir' )+1 ]
+			get_input_files = lambda: get_FASTQ_files( directory )
+		else:
+			input_file = arguments[ arguments.index( '--in_file' if '--in_file' in arguments else '--in' )+1 ]
+			get_input_files = lambda: [ input_file ] if os.path.isfile( input_file ) else []
+		follow_FASTQ_files( get_input_files, qual_status, qual_mode, interval, max_idle_time, arguments )
+	
+	elif '--in_file' in arguments or '--in' in arguments:	#single file mode
 		if '--in_file' in arguments:
 			input_file = arguments[ arguments.index( '--in_file' )+1 ]
 		elif '--in' in arguments:
 			input_file = arguments[ arguments.index( '--in' )+1 ]
-		total_length, average_quality = analyze_FASTQ( input_file, qual_status )
-		if '--rfig' in arguments:
-			read_len_fig_file = arguments[ arguments.index( '--rfig' )+1 ]
-			if '--cutoff' in arguments:
-				len_cutoff = int( arguments[ arguments.index( '--cutoff' )+1 ] )
-			else:
-				len_cutoff = 100
-			generate_read_len_hist( total_length, read_len_fig_file, len_cutoff )
-		if '--qfig' in arguments:
-			quality_vs_read_len_fig_file = arguments[ arguments.index( '--qfig' )+1 ]
-			
-			if '--qualcut' in arguments:
-				max_qual_cut = int( arguments[ arguments.index( '--qualcut' )+1 ] )
-			else:
-				max_qual_cut = 40
-			if '--lencut' in arguments:
-				max_len_cut = int( arguments[ arguments.index( '--lencut' )+1 ] )
-			else:
-				max_len_cut = 200
-			
-			generate_quality_vs_read_len_figure( total_length, average_quality, quality_vs_read_len_fig_file, max_qual_cut, max_len_cut )
+		if '--sample' in arguments:	#estimates based on subset of reads
+			sample_label = arguments[ arguments.index( '--sample' )+1 ]
+			try:
+				sample_mode, sample_size = sample_label.split(':')
+				sample_size = int( sample_size ) if sample_mode in [ "reservoir", "every" ] else float( sample_size )	#number of reads must be an integer
+			except ValueError:
+				sys.exit( "ERROR: --sample must be <reservoir|every|time|bytes>:<VALUE>." )
+			if sample_mode not in [ "reservoir", "every", "time", "bytes" ] or not sample_size > 0:
+				sys.exit( "ERROR: --sample must be <reservoir|every|time|bytes>:<VALUE>." )
+			sample = sample_FASTQ( input_file, qual_status, qual_mode, sample_mode, sample_size )
+			write_sample_estimates( input_file, sample, qual_status, sample_label )
+			stats = add_reads_to_stats( new_FASTQ_stats(), sample['lengths'], sample['gc'].sum(), sample['quals'] if qual_status else None )
+			generate_figures( stats, arguments )
+			return
+		stats = analyze_FASTQ( input_file, qual_status, qual_mode, decompressor, '--timing' in arguments, kmer_size, kmer_scale )
+		if kmer_size > 0:
+			write_kmer_stats( stats, kmer_hist_file )
+		if '--summary' in arguments:
+			save_FASTQ_stats( stats, arguments[ arguments.index( '--summary' )+1 ], qual_mode if qual_status else None )
+		generate_figures( stats, arguments )
+	
+	elif '--merge' in arguments:	#combination of summary files
+		summary_files = arguments[ arguments.index( '--merge' )+1 ].split(',')
+		stats, merged_qual_mode = merge_FASTQ_summaries( summary_files )
+		write_FASTQ_stats( "merged (" + str( len( summary_files ) ) + " summaries)", stats, merged_qual_mode is not None )
+		if '--summary' in arguments:
+			save_FASTQ_stats( stats, arguments[ arguments.index( '--summary' )+1 ], merged_qual_mode )
+		generate_figures( stats, arguments )
 	
 	else:	#folder analysis mode
 		directory = arguments[ arguments.index( '--in_dir' )+1 ]
-		if directory[-1] != '/':
-			directory += "/"
-		input_files = []
-		extensions = [ ".fq", ".fastq", ".fq.gzip", ".fastq.gzip", ".fq.gz", ".fastq.gz", ".FQ", ".FASTQ", ".FQ.GZIP", ".FASTQ.GZIP", ".FQ.GZ", ".FASTQ.GZ" ]
-		for extension in extensions:
-			input_files += glob.glob( directory + '*' + extension )
-		for filename in input_files:
-			try:
-				total_length, average_quality = analyze_FASTQ( filename, qual_status )
-			except:
-				sys.stdout.write( "ERROR while processing " + filename + "\n" )
-				sys.stdout.flush()
+		if '--threads' in arguments:
+			threads = int( arguments[ arguments.index( '--threads' )+1 ] )
+		else:
+			threads = 1
+		if '--summary_dir' in arguments:
+			summary_dir = arguments[ arguments.index( '--summary_dir' )+1 ]
+			if not os.path.exists( summary_dir ):
+				os.makedirs( summary_dir )
+		else:
+			summary_dir = None
+		
+		# --- cache of statistics of already analyzed files --- #
+		if '--cache' in arguments or '--cache_file' in arguments or '--clear_cache' in arguments:
+			if '--cache_file' in arguments:
+				cache_file = arguments[ arguments.index( '--cache_file' )+1 ]
+			else:
+				cache_file = os.path.join( directory, ".FASTQ_stats3_cache.sqlite" )
+			cache = open_stats_cache( cache_file )
+			if '--clear_cache' in arguments:
+				cache.execute( "DELETE FROM stats" )
+				cache.commit()
+		else:
+			cache = None
+		if '--cache_size' in arguments:
+			max_cache_size = int( float( arguments[ arguments.index( '--cache_size' )+1 ] ) * 1000000 )
+		else:
+			max_cache_size = 500000000
+		
+		if cache is not None and kmer_size > 0:
+			sys.stdout.write( "WARNING: cache is not used for k-mer analysis.\n" )
+			sys.stdout.flush()
+			cache = None
+		
+		input_files = get_FASTQ_files( directory )
+		total_stats = analyze_FASTQ_files( input_files, qual_status, qual_mode, threads, summary_dir, cache, '--cache_hash' in arguments, decompressor, '--timing' in arguments, kmer_size, kmer_scale )
+		if kmer_size > 0 and total_stats is not None:
+			write_kmer_stats( total_stats, kmer_hist_file )
+		if cache is not None:
+			evict_cached_stats( cache, max_cache_size )
+			cache.close()
 
 
-if '--in_file' in sys.argv or '--in_dir' in sys.argv or '--in' in sys.argv:
-	main( sys.argv )
-else:
-	sys.exit( __usage__ )
+if __name__ == '__main__':	#worker processes of the pool must not run main again
+	if '--in_file' in sys.argv or '--in_dir' in sys.argv or '--in' in sys.argv or '--merge' in sys.argv or sys.argv[1:2] == [ 'plot' ]:
+		main( sys.argv )
+	else:
+		sys.exit( __usage__ )
 
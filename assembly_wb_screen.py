@@ -19,49 +19,346 @@ __usage__ = """
 					
 					optional:
 					--tmp <TMP_FOLDER>[output folder]
+					--fragment_size <FRAGMENT_SIZE_IN_BP>[10000]
+					--overlap <OVERLAP_OF_NEIGHBOURING_FRAGMENTS_IN_BP>[0]
+					--threads <NUMBER_OF_CPUS>[1]
+					--shards <NUMBER_OF_FRAGMENT_FILE_PARTS>[threads]
+					--blastn <BLASTN_EXECUTABLE>[blastn]
+					--makeblastdb <MAKEBLASTDB_EXECUTABLE>[makeblastdb]
+					--db_cache <BLAST_DATABASE_CACHE_FOLDER>[off]
+					
+					Usage (clean BLAST database cache):
+					python3 assembly_wb_screen.py
+					--db_cache <BLAST_DATABASE_CACHE_FOLDER>
+					--clean_db_cache <MAX_CACHE_SIZE_IN_GB>
 					
 					bug reports and feature requests: b.pucker@tu-bs.de
 					"""
 
-import os, sys, re, glob, subprocess
+import os, sys, re, glob, time, fcntl, shutil, hashlib, itertools, subprocess, collections
 
 # --- end of imports --- #
 
+MAKEBLASTDB_PARAMETERS = [ "-dbtype", "nucl" ]
+
 
-def load_sequences( fasta_file ):
-	"""! @brief load sequences of given FASTA file into dictionary with sequence IDs as keys and sequences as values """
+def generate_fragment_file( assembly_file, fragment_file, fragment_size, overlap=0, manifest_file=None ):
+	"""! @brief generate file with sequence fragments based on assembly file; fragments are written while the assembly is read
 	
-	sequences = {}
-	with open( fasta_file ) as f:
-		header = f.readline()[1:].strip()
-		if " " in header:	#take only the space-free part of the header (if space present)
-			header = header.split(' ')[0]
-		seq = []
-		line = f.readline()
-		while line:
-			if line[0] == '>':
-					sequences.update( { header: "".join( seq ) } )
-					header = line.strip()[1:]
-					if " " in header:
-						header = header.split(' ')[0]
-					seq = []
-			else:
-				seq.append( line.strip() )
-			line = f.readline()
-		sequences.update( { header: "".join( seq ) } )	
-	return sequences
+		@param overlap (int) number of bases shared by neighbouring fragments of a contig
+		
+		@param manifest_file (string) table with fragment ID, contig ID, start and end (1-based, inclusive) of each fragment; not written if None
+		
+		Contig IDs (header until the first space) must be unique. Files are written with .tmp suffix and renamed once complete.
+	"""
+	
+	step = fragment_size - overlap
+	contig = None
+	contigs = set()
+	duplicate = None
+	buffer = bytearray()	#bases of the current contig starting at the start of the next fragment
+	start = 0
+	fragment_number = 0
+	
+	def write_fragment( length ):
+		"""! @brief write the next fragment of the current contig """
+		
+		nonlocal fragment_number
+		fragment_ID = contig + "_%_" + str( fragment_number ).zfill(4)
+		out.write( b'>' + fragment_ID.encode() + b"\n" + bytes( buffer[ :length ] ) + b"\n" )
+		if manifest is not None:
+			manifest.write( "\t".join( [ fragment_ID, contig, str( start + 1 ), str( start + length ) ] ) + "\n" )
+		fragment_number += 1
+	
+	with open( fragment_file + ".tmp", "wb" ) as out:
+		manifest = None if manifest_file is None else open( manifest_file + ".tmp", "w" )
+		try:
+			if manifest is not None:
+				manifest.write( "FragmentID\tContigID\tStart\tEnd\n" )
+			with open( assembly_file, "rb" ) as f:
+				end_of_file = b'>'
+				for line in itertools.chain( f, [ end_of_file ] ):	#last line triggers output of the last fragment
+					if line[:1] == b'>':
+						if contig is not None and len( buffer ) > 0:	#last fragment reaches the end of the contig
+							write_fragment( len( buffer ) )
+						contig = line.strip()[1:].decode().split(' ')[0]
+						if contig in contigs and line is not end_of_file:	#fragment IDs and BLAST results would be ambiguous
+							duplicate = contig
+							break
+						contigs.add( contig )
+						buffer = bytearray()
+						start = 0
+						fragment_number = 0
+					else:
+						buffer += line.strip()
+						while len( buffer ) > fragment_size:	#fragment does not reach the end of the contig
+							write_fragment( fragment_size )
+							del buffer[ :step ]
+							start += step
+		finally:
+			if manifest is not None:
+				manifest.close()
+	if duplicate is not None:
+		remove_file( fragment_file + ".tmp" )
+		remove_file( None if manifest_file is None else manifest_file + ".tmp" )
+		sys.exit( "ERROR: duplicate contig name in " + assembly_file + ": " + duplicate )
+	os.replace( fragment_file + ".tmp", fragment_file )
+	if manifest_file is not None:
+		os.replace( manifest_file + ".tmp", manifest_file )
+
+
+def load_fragment_IDs( manifest_file ):
+	"""! @brief load IDs of all fragments from fragment manifest file """
+	
+	fragment_IDs = []
+	with open( manifest_file, "r" ) as f:
+		f.readline()	#remove header
+		for line in f:
+			if len( line.strip() ) > 0:
+				fragment_IDs.append( line.split('\t')[0] )
+	return fragment_IDs
+
+
+def split_fragment_file( fragment_file, shard_files ):
+	"""! @brief split fragment file into shards of similar size; the order of fragments is kept across consecutive shards
+	
+		@return shard files that received fragments (fewer than given if there are fewer fragments than shards)
+	"""
+	
+	target_size = os.path.getsize( fragment_file ) / len( shard_files )
+	written = 0
+	used_shard_files = []
+	out = None
+	try:
+		with open( fragment_file, "rb" ) as f:
+			for line in f:
+				if line[:1] == b'>' and ( out is None or ( written >= target_size * len( used_shard_files ) and len( used_shard_files ) < len( shard_files ) ) ):
+					if out is not None:
+						out.close()
+					out = open( shard_files[ len( used_shard_files ) ], "wb" )
+					used_shard_files.append( shard_files[ len( used_shard_files ) ] )
+				out.write( line )
+				written += len( line )
+	finally:
+		if out is not None:
+			out.close()
+	return used_shard_files
+
+
+def run_commands( jobs, processes ):
+	"""! @brief run external commands in parallel; each result file is moved to its final name once the command finished successfully
+	
+		All running commands are stopped and their temporary result files are removed as soon as one command fails.
+		
+		@param jobs (list) tuples of command (list of arguments), temporary result file and final result file (None if there is no result file to move)
+	"""
+	
+	waiting = collections.deque( jobs )
+	running = []	#pairs of process and job
+	try:
+		while len( waiting ) > 0 or len( running ) > 0:
+			while len( waiting ) > 0 and len( running ) < max( 1, processes ):
+				job = waiting.popleft()
+				running.append( ( subprocess.Popen( job[0] ), job ) )
+			finished = [ ( process, job ) for process, job in running if process.poll() is not None ]
+			if len( finished ) == 0:
+				time.sleep( 0.1 )
+				continue
+			for process, ( command, tmp_file, result_file ) in finished:
+				running.remove( ( process, ( command, tmp_file, result_file ) ) )
+				if process.returncode != 0:
+					remove_file( tmp_file )
+					sys.exit( "ERROR: command failed: " + " ".join( command ) )
+				if result_file is not None:
+					os.replace( tmp_file, result_file )
+	finally:	#only reached with running commands after an error or an interruption
+		for process, job in running:
+			process.terminate()
+		for process, ( command, tmp_file, result_file ) in running:
+			try:
+				process.wait( timeout=10 )
+			except subprocess.TimeoutExpired:
+				process.kill()
+				process.wait()
+			remove_file( tmp_file )
+
+
+def remove_file( filename ):
+	"""! @brief remove file if it exists (None is ignored) """
+	
+	if filename is not None and os.path.isfile( filename ):
+		os.remove( filename )
+
+
+def merge_files( input_files, output_file ):
+	"""! @brief concatenate given files in the given order """
+	
+	with open( output_file + ".tmp", "wb" ) as out:
+		for input_file in input_files:
+			with open( input_file, "rb" ) as f:
+				while True:
+					block = f.read( 16 * 1024 * 1024 )
+					if not block:
+						break
+					out.write( block )
+	os.replace( output_file + ".tmp", output_file )	#incomplete merges are not taken as results of a previous run
+
+
+def get_file_checksum( filename, db_cache ):
+	"""! @brief calculate sha256 of file content; the checksum is stored in the cache folder and reused while path, size and modification time of the file are unchanged """
+	
+	path = os.path.abspath( filename )
+	status = os.stat( path )
+	identity = "\t".join( [ path, str( status.st_size ), str( status.st_mtime_ns ) ] )
+	checksum_file = os.path.join( db_cache, "checksums", hashlib.sha256( path.encode() ).hexdigest() + ".txt" )
+	try:
+		with open( checksum_file, "r" ) as f:
+			stored_identity, checksum = f.read().rstrip( "\n" ).rsplit( "\t", 1 )
+		if stored_identity == identity:
+			return checksum
+	except ( OSError, ValueError ):	#no valid stored checksum
+		pass
+	
+	checksum = hashlib.sha256()
+	with open( path, "rb" ) as f:
+		while True:
+			block = f.read( 16 * 1024 * 1024 )
+			if not block:
+				break
+			checksum.update( block )
+	checksum = checksum.hexdigest()
+	os.makedirs( os.path.dirname( checksum_file ), exist_ok=True )
+	with open( checksum_file + "." + str( os.getpid() ) + ".tmp", "w" ) as out:
+		out.write( identity + "\t" + checksum + "\n" )
+	os.replace( checksum_file + "." + str( os.getpid() ) + ".tmp", checksum_file )
+	return checksum
+
+
+def get_db_cache_key( list_file, parameters, db_cache ):
+	"""! @brief calculate cache key of BLAST database based on the content of the list file and the makeblastdb parameters """
+	
+	return hashlib.sha256( ( get_file_checksum( list_file, db_cache ) + "\0" + " ".join( parameters ) ).encode() ).hexdigest()
 
 
-def generate_fragment_file( assembly_file, fragment_file, fragment_size ):
-	"""! @brief generate file with sequence fragments based on assembly file """
+def lock_file( lock_path, operation ):
+	"""! @brief open lock file and lock it with flock; repeated if the lock file was removed by the cache cleaning in the meantime
 	
-	assembly = load_sequences( assembly_file )
+		@return open lock file (None if a non-blocking lock was not acquired)
+	"""
 	
-	with open( fragment_file, "w" ) as out:
-		for key in list( assembly.keys() ):
-			chunks = [ assembly[ key ][ i:i+fragment_size ] for i in range( 0, len( assembly[ key ] ), fragment_size ) ]
-			for idx, chunk in enumerate( chunks ):
-				out.write( '>' + key + "_%_" + ( str( idx ).zfill(4) ) + "\n" + chunk + "\n" )
+	while True:
+		lock = open( lock_path, "a" )
+		try:
+			fcntl.flock( lock, operation )
+		except BlockingIOError:
+			lock.close()
+			return None
+		try:
+			if os.path.samestat( os.fstat( lock.fileno() ), os.stat( lock_path ) ):
+				return lock
+		except FileNotFoundError:
+			pass
+		lock.close()
+
+
+def get_cached_blast_db( makeblastdb, list_file, db_cache, db_locks ):
+	"""! @brief get BLAST database of list file from cache; the database is built if it is not cached yet
+	
+		<key>.lock: shared lock of all jobs that use the database (exclusive lock for eviction)
+		<key>.build.lock: exclusive lock of the job that checks and builds the database
+		
+		@param db_locks (dict) open lock files of databases used by this run (the shared lock protects a database against eviction until the lock file is closed)
+		
+		@return prefix of BLAST database
+	"""
+	
+	entry = os.path.join( db_cache, get_db_cache_key( list_file, MAKEBLASTDB_PARAMETERS, db_cache ) )
+	if entry not in db_locks:	#white and black list could be identical
+		use_lock = lock_file( entry + ".lock", fcntl.LOCK_SH )	#held before the build, so the new database cannot be evicted
+		build_lock = lock_file( entry + ".build.lock", fcntl.LOCK_EX )	#concurrent jobs wait for the build of the same database
+		try:
+			if not os.path.isdir( entry ):
+				tmp_entry = entry + ".tmp"
+				if os.path.exists( tmp_entry ):	#leftover of an interrupted build
+					shutil.rmtree( tmp_entry )
+				os.makedirs( tmp_entry )
+				run_commands( [ ( [ makeblastdb, "-in", list_file, "-out", os.path.join( tmp_entry, "db" ) ] + MAKEBLASTDB_PARAMETERS, None, None ) ], 1 )
+				os.rename( tmp_entry, entry )	#complete databases appear at once
+		finally:
+			build_lock.close()
+		os.utime( entry )	#time of last use for eviction
+		db_locks.update( { entry: use_lock } )
+	return os.path.join( entry, "db" )
+
+
+def remove_cache_locks( entry ):
+	"""! @brief remove lock files of a database that is not cached (anymore); lock files in use are kept
+	
+		@return True if the lock files were removed
+	"""
+	
+	use_lock = lock_file( entry + ".lock", fcntl.LOCK_EX | fcntl.LOCK_NB )
+	if use_lock is None:
+		return False
+	try:
+		build_lock = lock_file( entry + ".build.lock", fcntl.LOCK_EX | fcntl.LOCK_NB )
+		if build_lock is None:
+			return False
+		try:
+			if os.path.exists( entry ) or os.path.exists( entry + ".tmp" ):	#database was built in the meantime
+				return False
+			os.remove( entry + ".build.lock" )
+			os.remove( entry + ".lock" )
+			return True
+		finally:
+			build_lock.close()
+	finally:
+		use_lock.close()
+
+
+def clean_db_cache( db_cache, max_size ):
+	"""! @brief remove least recently used databases from cache until the cache is not larger than the given size (bytes); databases in use are kept
+	
+		Leftovers of interrupted builds (<key>.tmp) and lock files without database are removed as well.
+	"""
+	
+	keys = set( [ name[ :64 ] for name in os.listdir( db_cache ) if re.match( "[0-9a-f]{64}(\\.|$)", name ) ] )
+	entries = []
+	removed_leftovers = 0
+	for key in sorted( keys ):
+		entry = os.path.join( db_cache, key )
+		if os.path.isdir( entry + ".tmp" ):
+			build_lock = lock_file( entry + ".build.lock", fcntl.LOCK_EX | fcntl.LOCK_NB )
+			if build_lock is not None:	#no running build
+				shutil.rmtree( entry + ".tmp" )
+				build_lock.close()
+				removed_leftovers += 1
+		if os.path.isdir( entry ):
+			size = 0
+			for folder, subfolders, files in os.walk( entry ):
+				for filename in files:
+					size += os.path.getsize( os.path.join( folder, filename ) )
+			entries.append( ( os.path.getmtime( entry ), size, entry ) )
+		elif not os.path.exists( entry + ".tmp" ):
+			removed_leftovers += int( remove_cache_locks( entry ) )
+	
+	total_size = sum( [ x[1] for x in entries ] )
+	removed = 0
+	for last_use, size, entry in sorted( entries ):
+		if total_size <= max_size:
+			break
+		use_lock = lock_file( entry + ".lock", fcntl.LOCK_EX | fcntl.LOCK_NB )
+		if use_lock is None:
+			sys.stdout.write( "WARNING: database in use is not removed: " + entry + "\n" )
+			sys.stdout.flush()
+			continue
+		shutil.rmtree( entry )
+		use_lock.close()
+		remove_cache_locks( entry )
+		total_size -= size
+		removed += 1
+	sys.stdout.write( "removed databases: " + str( removed ) + "\tremoved leftovers of interrupted runs: " + str( removed_leftovers ) + "\tremaining cache size (bytes): " + str( total_size ) + "\n" )
+	sys.stdout.flush()
 
 
 def load_BLAST_results( blast_result_file ):
@@ -154,48 +451,108 @@ def main( arguments ):
 		os.makedirs( tmp_folder )
 	
 	
-	fragment_size = 10000	#10kb (size of individual fragments for BLAST search)
+	if '--fragment_size' in arguments:
+		fragment_size = int( arguments[ arguments.index('--fragment_size')+1 ] )
+	else:
+		fragment_size = 10000	#10kb (size of individual fragments for BLAST search)
+	
+	if '--overlap' in arguments:
+		overlap = int( arguments[ arguments.index('--overlap')+1 ] )
+	else:
+		overlap = 0
+	
+	if fragment_size < 1 or overlap < 0 or overlap >= fragment_size:
+		sys.exit( "ERROR: --fragment_size must be positive and --overlap must be smaller than --fragment_size" )
+	
+	if '--threads' in arguments:
+		cpus = int( arguments[ arguments.index('--threads')+1 ] )
+	else:
+		cpus = 1
+	
+	if '--shards' in arguments:
+		shards = int( arguments[ arguments.index('--shards')+1 ] )
+	else:
+		shards = cpus
+	
+	if cpus < 1 or shards < 1:
+		sys.exit( "ERROR: --threads and --shards must be positive" )
+	
+	if '--blastn' in arguments:
+		blastn = arguments[ arguments.index('--blastn')+1 ]
+	else:
+		blastn = "blastn"
+	
+	if '--makeblastdb' in arguments:
+		makeblastdb = arguments[ arguments.index('--makeblastdb')+1 ]
+	else:
+		makeblastdb = "makeblastdb"
+	
+	if '--db_cache' in arguments:
+		db_cache = arguments[ arguments.index('--db_cache')+1 ]
+		if not os.path.exists( db_cache ):
+			os.makedirs( db_cache, exist_ok=True )
+	else:
+		db_cache = None
+	
 	evalue = 0.0001
-	cpus = 1
 	cutoff_ratio = 2	#score ratio of best white vs. best black hit to consider sequence as clean
 	
 	
 	fragment_file = output_folder + "fragments.fasta"
-	if not os.path.isfile( fragment_file ):
-		generate_fragment_file( assembly_file, fragment_file, fragment_size )	#split assembly into parts
+	manifest_file = output_folder + "fragments.txt"
+	if not os.path.isfile( fragment_file ) or not os.path.isfile( manifest_file ):
+		generate_fragment_file( assembly_file, fragment_file, fragment_size, overlap, manifest_file )	#split assembly into parts
 	
-	# --- run BLAST vs. white --- #
+	# --- run BLAST vs. white and black --- #
 	white_blast_result_file = tmp_folder + "white_blast_result_file.txt"
-	if not os.path.isfile( white_blast_result_file ):
-		white_blast_db = tmp_folder + "white_db"
-		p = subprocess.Popen( args= "makeblastdb -in " + white_file + " -out " + white_blast_db + " -dbtype nucl", shell=True )
-		p.communicate()
-		
-		p = subprocess.Popen( args= "blastn -query " + fragment_file + " -db " + white_blast_db + " -out " + white_blast_result_file + " -outfmt 6 -evalue " + str( evalue ) + " -num_threads " + str( cpus ), shell=True )
-		p.communicate()
-	
-	# --- run BLAST vs. black --- #
 	black_blast_result_file = tmp_folder + "black_blast_result_file.txt"
-	if not os.path.isfile( black_blast_result_file ):
-		black_blast_db = tmp_folder + "black_db"
-		p = subprocess.Popen( args= "makeblastdb -in " + black_file + " -out " + black_blast_db + " -dbtype nucl", shell=True )
-		p.communicate()
+	searches = []
+	for name, list_file, blast_result_file in [ ( "white", white_file, white_blast_result_file ), ( "black", black_file, black_blast_result_file ) ]:
+		if not os.path.isfile( blast_result_file ):
+			searches.append( ( name, list_file, tmp_folder + name + "_db", blast_result_file ) )
+	
+	if len( searches ) > 0:
+		db_locks = {}
+		if db_cache is None:
+			db_jobs = [ ( [ makeblastdb, "-in", list_file, "-out", blast_db ] + MAKEBLASTDB_PARAMETERS, None, None ) for name, list_file, blast_db, blast_result_file in searches ]
+			run_commands( db_jobs, min( len( db_jobs ), cpus ) )
+		else:
+			searches = [ ( name, list_file, get_cached_blast_db( makeblastdb, list_file, db_cache, db_locks ), blast_result_file ) for name, list_file, blast_db, blast_result_file in searches ]
 		
-		p = subprocess.Popen( args= "blastn -query " + fragment_file + " -db " + black_blast_db + " -out " + black_blast_result_file + " -outfmt 6 -evalue " + str( evalue ) + " -num_threads " + str( cpus ), shell=True )
-		p.communicate()
-
+		shard_files = split_fragment_file( fragment_file, [ tmp_folder + "fragments." + str( i ).zfill(4) + "_of_" + str( shards ) + ".fasta" for i in range( shards ) ] )
+		processes = min( cpus, len( searches ) * len( shard_files ) )
+		threads_per_process = max( 1, cpus // max( 1, processes ) )	#remaining CPUs are used by blastn threads
+		
+		blast_jobs = []
+		shard_result_files = {}
+		for name, list_file, blast_db, blast_result_file in searches:
+			shard_result_files.update( { name: [] } )
+			for shard_file in shard_files:
+				shard_result_file = shard_file[ :-len( ".fasta" ) ] + "." + name + "_blast_result_file.txt"
+				shard_result_files[ name ].append( shard_result_file )
+				if not os.path.isfile( shard_result_file ):	#results of completed shards are reused
+					blast_jobs.append( ( [ blastn, "-query", shard_file, "-db", blast_db, "-out", shard_result_file + ".tmp", "-outfmt", "6", "-evalue", str( evalue ), "-num_threads", str( threads_per_process ) ], shard_result_file + ".tmp", shard_result_file ) )
+		run_commands( blast_jobs, processes )
+		
+		for name, list_file, blast_db, blast_result_file in searches:
+			merge_files( shard_result_files[ name ], blast_result_file )
+		for lock in db_locks.values():	#cached databases can be evicted again
+			lock.close()
+	
 	# --- load BLAST results --- #
 	white_hits = load_BLAST_results( white_blast_result_file )
 	black_hits = load_BLAST_results( black_blast_result_file )
 	
 	# --- analyze results --- #
-	headers = sorted( list( load_sequences( fragment_file ).keys() ) )
+	headers = sorted( load_fragment_IDs( manifest_file ) )
 	detail_output_file = output_folder + "BLAST_result_details.txt"
 	generate_BLAST_result_output_file( white_hits, black_hits, headers, detail_output_file, cutoff_ratio )
 
 
 
-if '--in' in sys.argv and '--out' in sys.argv and '--white' in sys.argv and '--black' in sys.argv:
+if '--db_cache' in sys.argv and '--clean_db_cache' in sys.argv:
+	clean_db_cache( sys.argv[ sys.argv.index('--db_cache')+1 ], float( sys.argv[ sys.argv.index('--clean_db_cache')+1 ] ) * 1024**3 )
+elif '--in' in sys.argv and '--out' in sys.argv and '--white' in sys.argv and '--black' in sys.argv:
 	main( sys.argv )
 else:
 	sys.exit( __usage__ )
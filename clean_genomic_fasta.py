@@ -7,39 +7,425 @@ __usage__ = """
 					python3 clean_genomic_fasta.py
 					--in <INPUT_FILE>
 					--out <OUTPUT_FILE>
+					
+					optional:
+					--bgzip (output is BGZF compressed; also used if output file ends with .gz or .bgz)
+					--threads <NUMBER_OF_PROCESSES_AND_COMPRESSION_THREADS> [1]
+					--width <SEQUENCE_LINE_LENGTH> (0 = one line per sequence; default: line breaks are kept)
 					"""
 
-import os, sys
+import io, os, sys, zlib, queue, shutil, struct, threading, functools, subprocess, collections, concurrent.futures
+import numpy as np
 
 # --- end of imports --- #
 
+BLOCK_SIZE = 16 * 1024 * 1024	#bytes read at once
+SEQUENCE_WHITESPACE = b' \t\r\x0b\x0c'	#removed from both ends of sequence lines (like bytes.strip)
+RANGE_SIZE = 64 * 1024 * 1024	#bytes of the input FASTA file per parallel task (ranges start at headers)
+
+READ_BLOCK_SIZE = 16 * 1024 * 1024	#compressed bytes per read() call of the gzip reader
+QUEUE_SIZE = 4	#maximal number of decompressed blocks waiting for the parser
+
+BGZF_BLOCK_SIZE = 65280	#uncompressed bytes per BGZF block (like htslib)
+BGZF_EOF = bytes.fromhex( "1f8b08040000000000ff0600424302001b0003000000000000000000" )	#empty block at the end of BGZF files
+
+
+def is_compressed_file( filename ):
+	"""! @brief check if file is gzip compressed (including BGZF) based on the first bytes """
+	
+	with open( filename, "rb" ) as f:
+		return f.read( 2 ) == b'\x1f\x8b'
+
+
+def decompress_gzip_block( state, block ):
+	"""! @brief decompress next bytes of a (multi-member) gzip file """
+	
+	data = []
+	while block:
+		data.append( state['decompressor'].decompress( block ) )
+		if state['decompressor'].eof and len( state['decompressor'].unused_data ) > 0:	#next gzip member (e.g. BGZF block)
+			block = state['decompressor'].unused_data
+			state['decompressor'] = zlib.decompressobj( 16 + zlib.MAX_WBITS )
+		else:
+			block = b""
+	return b"".join( data )
+
+
+def put_block( blocks, item, stop ):
+	"""! @brief put item into bounded queue unless the consumer stopped reading """
+	
+	while not stop.is_set():
+		try:
+			blocks.put( item, timeout=0.1 )
+			return
+		except queue.Full:
+			pass
+
+
+def produce_blocks( source, gzip_state, blocks, stop ):
+	"""! @brief read (and decompress) blocks of source and put them into bounded queue; None marks the end of the file """
+	
+	try:
+		state = { 'decompressor': zlib.decompressobj( 16 + zlib.MAX_WBITS ) }
+		while not stop.is_set():
+			raw = source.read( READ_BLOCK_SIZE )
+			if not raw:
+				break
+			block = decompress_gzip_block( state, raw ) if gzip_state else raw
+			if len( block ) > 0:
+				put_block( blocks, block, stop )
+		if gzip_state and not state['decompressor'].eof:
+			raise EOFError( "compressed file ended before the end-of-stream marker was reached" )
+		put_block( blocks, None, stop )
+	except Exception as error:
+		put_block( blocks, error, stop )
+
+
+def read_gzip_blocks( filename ):
+	"""! @brief yield decompressed blocks of gzip file; decompression runs in a separate thread (or in igzip/pigz if available) that hands the blocks to the parser through a bounded queue (like FASTQ_stats3.py) """
+	
+	external = None
+	for tool in [ "igzip", "pigz" ]:
+		if shutil.which( tool ):
+			external = tool
+			break
+	
+	process = None
+	if external is not None:
+		process = subprocess.Popen( [ external, "-dc", filename ], stdout=subprocess.PIPE )
+		source = process.stdout
+	else:
+		source = open( filename, "rb" )
+	
+	blocks = queue.Queue( maxsize=QUEUE_SIZE )
+	stop = threading.Event()
+	producer = threading.Thread( target=produce_blocks, args=( source, external is None, blocks, stop ), daemon=True )
+	producer.start()
+	try:
+		while True:
+			block = blocks.get()
+			if block is None:
+				break
+			if isinstance( block, Exception ):
+				raise block
+			yield block
+		if process is not None and process.wait() != 0:
+			raise OSError( external + " failed to decompress " + filename )
+	finally:
+		stop.set()
+		if process is not None and process.poll() is None:
+			process.kill()
+		producer.join()
+		source.close()
+		if process is not None:
+			process.wait()
+
+
+class GzipBlockStream( io.RawIOBase ):
+	"""! @brief binary file object that reads the decompressed blocks of read_gzip_blocks """
+	
+	def __init__( self, filename ):
+		self.blocks = read_gzip_blocks( filename )
+		self.block = b""
+		self.offset = 0
+	
+	def readable( self ):
+		return True
+	
+	def readinto( self, buffer ):
+		"""! @brief copy the next decompressed bytes into buffer; 0 at the end of the file """
+		
+		while self.offset >= len( self.block ):
+			self.block = next( self.blocks, None )
+			self.offset = 0
+			if self.block is None:
+				self.block = b""
+				return 0
+		size = min( len( buffer ), len( self.block ) - self.offset )
+		buffer[ :size ] = self.block[ self.offset:self.offset + size ]
+		self.offset += size
+		return size
+	
+	def close( self ):
+		if not self.closed:
+			self.blocks.close()	#stops decompression thread or process
+		super().close()
+
+
+def open_FASTA_file( filename ):
+	"""! @brief open FASTA file for reading in binary mode; gzip and BGZF compressed files are decompressed on the fly in a separate thread or process """
+	
+	if is_compressed_file( filename ):
+		return io.BufferedReader( GzipBlockStream( filename ), buffer_size=1024 * 1024 )
+	return open( filename, "rb" )
+
+
+def compress_bgzf_block( data, level=6 ):
+	"""! @brief compresses data into one BGZF block (gzip member with BC extra field); data is split if the block would exceed 64 kb """
+	
+	compressor = zlib.compressobj( level, zlib.DEFLATED, -15 )	#raw deflate
+	deflated = compressor.compress( data ) + compressor.flush()
+	if len( deflated ) + 26 > 65536:
+		half = len( data ) // 2
+		return compress_bgzf_block( data[ :half ], level ) + compress_bgzf_block( data[ half: ], level )
+	header = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00' + struct.pack( '<H', len( deflated ) + 25 )	#block size - 1
+	return header + deflated + struct.pack( '<II', zlib.crc32( data ) & 0xffffffff, len( data ) )
+
+
+class BGZFWriter( object ):
+	"""! @brief file object for writing BGZF compressed files (indexable by samtools faidx); blocks are compressed in parallel threads """
+	
+	def __init__( self, filename, threads=1, level=6 ):
+		self.out = open( filename, "wb" )
+		self.level = level
+		self.threads = max( 1, threads )
+		self.buffer = bytearray()
+		self.executor = concurrent.futures.ThreadPoolExecutor( max_workers=self.threads ) if self.threads > 1 else None
+	
+	def write( self, data ):
+		self.buffer += data
+		if len( self.buffer ) >= BGZF_BLOCK_SIZE * self.threads * 4:
+			self.write_blocks( final=False )
+		return len( data )
+	
+	def write_blocks( self, final ):
+		"""! @brief compresses all complete blocks in the buffer (and the incomplete last block if final) and writes them in order """
+		
+		end = len( self.buffer ) if final else len( self.buffer ) - len( self.buffer ) % BGZF_BLOCK_SIZE
+		chunks = [ bytes( self.buffer[ start:min( start + BGZF_BLOCK_SIZE, end ) ] ) for start in range( 0, end, BGZF_BLOCK_SIZE ) ]
+		del self.buffer[ :end ]
+		if self.executor is not None:	#zlib releases the GIL during compression
+			blocks = self.executor.map( functools.partial( compress_bgzf_block, level=self.level ), chunks )
+		else:
+			blocks = map( functools.partial( compress_bgzf_block, level=self.level ), chunks )
+		for block in blocks:
+			self.out.write( block )
+	
+	def close( self ):
+		if self.out.closed:
+			return
+		self.write_blocks( final=True )
+		self.out.write( BGZF_EOF )
+		self.out.close()
+		if self.executor is not None:
+			self.executor.shutdown()
+	
+	def __enter__( self ):
+		return self
+	
+	def __exit__( self, exc_type, exc_value, traceback ):
+		self.close()
+
+
+def open_output_file( filename, bgzip=False, threads=1 ):
+	"""! @brief open output file in binary mode; BGZF compression is used if requested or if the filename ends with .gz or .bgz """
+	
+	if bgzip or filename.endswith( ( ".gz", ".bgz" ) ):
+		return BGZFWriter( filename, threads )
+	return open( filename, "wb" )
+
+
+def clean_header( line ):
+	"""! @brief clean header line (without line break): split at first white space (space or tab) and replace '|' by '_' """
+	
+	return line.rstrip( b'\r' ).split( b' ' )[0].split( b'\t' )[0].replace( b"|", b"_" )
+
+
+def wrap_sequence( seq, width ):
+	"""! @brief add line breaks after each width bases (length of seq must be a multiple of width) """
+	
+	lines = np.empty( ( len( seq ) // width, width + 1 ), dtype=np.uint8 )
+	lines[ :, :width ] = np.frombuffer( seq, dtype=np.uint8 ).reshape( -1, width )
+	lines[ :, width ] = ord( '\n' )
+	return lines.tobytes()
+
+
+def new_wrap_state():
+	"""! @brief state of the current record for re-wrapping: bases of an incomplete line and whether a line is open """
+	
+	return { 'pending': bytearray(), 'open_line': False }
+
+
+def finish_record( pieces, state, width ):
+	"""! @brief write remaining bases of the current record (only required for re-wrapping) """
+	
+	if width is None:
+		return
+	if len( state['pending'] ) > 0:
+		pieces.append( bytes( state['pending'] ) + b'\n' )
+		del state['pending'][:]
+	elif state['open_line']:
+		pieces.append( b'\n' )
+	state['open_line'] = False
+
+
+def strip_sequence_lines( seq_lines ):
+	"""! @brief remove white space at both ends of each sequence line (like line.strip() of the previous line-by-line version); white space within lines is kept """
+	
+	if len( seq_lines.translate( None, SEQUENCE_WHITESPACE ) ) == len( seq_lines ):	#no white space: lines are copied in one piece
+		return seq_lines
+	return b"\n".join( [ line.strip() for line in seq_lines.split( b"\n" ) ] )
+
+
+def add_sequence( pieces, state, seq_lines, width ):
+	"""! @brief copy sequence lines (white space at the line ends is removed) or re-wrap them """
+	
+	if width is None:
+		pieces.append( strip_sequence_lines( seq_lines ) )
+	elif width == 0:	#unwrap: sequence is written as one line
+		seq = strip_sequence_lines( seq_lines ).replace( b'\n', b'' )
+		if len( seq ) > 0:
+			pieces.append( seq )
+			state['open_line'] = True
+	else:
+		state['pending'] += strip_sequence_lines( seq_lines ).replace( b'\n', b'' )
+		complete = len( state['pending'] ) - len( state['pending'] ) % width
+		if complete > 0:
+			pieces.append( wrap_sequence( bytes( state['pending'][ :complete ] ), width ) )
+			del state['pending'][ :complete ]
+
+
+def clean_FASTA_lines( data, state, width ):
+	"""! @brief clean a block of complete FASTA lines; only header lines are modified and sequence lines are copied in one piece
+	
+		@param data (bytes) complete lines (last byte is a line break)
+		
+		@param state (dictionary) wrapping state of the current record (new_wrap_state)
+		
+		@param width (int) sequence line length; 0 = one line per sequence; None = line breaks are kept
+		
+		@return (bytes) cleaned block
+	"""
+	
+	pieces = []
+	pos = 0
+	while pos < len( data ):
+		if data[ pos:pos+1 ] == b'>':
+			finish_record( pieces, state, width )
+			end = data.index( b'\n', pos )
+			pieces.append( clean_header( data[ pos:end ] ) + b'\n' )
+			pos = end + 1
+		else:
+			next_header = data.find( b'\n>', pos )
+			end = len( data ) if next_header == -1 else next_header + 1
+			add_sequence( pieces, state, data[ pos:end ], width )
+			pos = end
+	return b"".join( pieces )
+
+
+def clean_FASTA_file( input_file, out, width=None ):
+	"""! @brief clean FASTA file in large blocks; a line break is added to the last line if missing """
+	
+	state = new_wrap_state()
+	with open_FASTA_file( input_file ) as f:
+		carry = b""	#incomplete last line of the previous block
+		while True:
+			block = f.read( BLOCK_SIZE )
+			if len( block ) == 0:
+				break
+			data = carry + block
+			cut = data.rfind( b'\n' ) + 1
+			carry = data[ cut: ]
+			if cut > 0:
+				out.write( clean_FASTA_lines( data[ :cut ], state, width ) )
+		if len( carry ) > 0:
+			out.write( clean_FASTA_lines( carry + b'\n', state, width ) )
+	pieces = []
+	finish_record( pieces, state, width )
+	out.write( b"".join( pieces ) )
+
+
+def get_record_aligned_ranges( filename, range_size=RANGE_SIZE ):
+	"""! @brief splits a FASTA file into byte ranges of about range_size that start at a header line
+	
+		@return (list) start and end position of all ranges
+	"""
+	
+	file_size = os.path.getsize( filename )
+	starts = [ 0 ]
+	with open( filename, "rb" ) as f:
+		while starts[-1] + range_size < file_size:
+			position = starts[-1] + range_size - 1	#include preceding byte to find line breaks right before the target position
+			next_start = None
+			while next_start is None:
+				f.seek( position )
+				chunk = f.read( 1048576 )
+				if len( chunk ) < 2:
+					break
+				idx = chunk.find( b'\n>' )
+				if idx >= 0:
+					next_start = position + idx + 1
+				else:
+					position += len( chunk ) - 1	#'\n>' can span two chunks
+			if next_start is None:	#no further header
+				break
+			starts.append( next_start )
+	return list( zip( starts, starts[1:] + [ file_size ] ) )
+
+
+def map_in_order( executor, function, arguments, window ):
+	"""! @brief like executor.map, but at most window tasks are submitted ahead of the consumed result (bounded memory) """
+	
+	futures = collections.deque()
+	for argument in arguments:
+		futures.append( executor.submit( function, *argument ) )
+		if len( futures ) >= window:
+			yield futures.popleft().result()
+	while len( futures ) > 0:
+		yield futures.popleft().result()
+
+
+def clean_FASTA_range( input_file, start, end, width ):
+	"""! @brief clean one byte range of a FASTA file that starts at a header (worker of the parallel mode) """
+	
+	with open( input_file, "rb" ) as f:
+		f.seek( start )
+		data = f.read( end - start )
+	if len( data ) > 0 and data[-1:] != b'\n':	#only possible at the end of the file
+		data += b'\n'
+	state = new_wrap_state()
+	pieces = [ clean_FASTA_lines( data, state, width ) ]
+	finish_record( pieces, state, width )
+	return b"".join( pieces )
+
+
+def clean_FASTA_file_parallel( input_file, out, width, threads ):
+	"""! @brief clean FASTA file in record-aligned byte ranges in parallel processes; the output is identical to clean_FASTA_file """
+	
+	ranges = get_record_aligned_ranges( input_file )
+	worker = functools.partial( clean_FASTA_range, input_file, width=width )
+	with concurrent.futures.ProcessPoolExecutor( max_workers=threads ) as executor:
+		for cleaned in map_in_order( executor, worker, ranges, threads * 2 ):
+			out.write( cleaned )
+
+
 def main( arguments ):
 	"""! @brief run everything """
 	
 	input_file = arguments[ arguments.index('--in')+1 ]
 	output_file = arguments[ arguments.index('--out')+1 ]
 	
-	with open( output_file, "w" ) as out:
-		with open( input_file, "r" ) as f:
-			line = f.readline()
-			while line:
-				if line[0] == ">":
-					if " " in line:
-						tmp = line.split(' ')[0].replace("|", "_")
-						if chr(9) in tmp:
-							tmp = tmp.split( chr(9) )[0]
-						out.write(  tmp + "\n" )
-					else:
-						if chr(9) in line:
-							out.write( line.split( chr(9) )[0].replace("|", "_") + "\n" )
-						else:
-							out.write( line.strip().replace("|", "_") + "\n" )
-				else:
-					out.write( line.strip() + "\n" )
-				line = f.readline()
+	if '--threads' in arguments:
+		threads = int( arguments[ arguments.index('--threads')+1 ] )
+	else:
+		threads = 1
+	
+	if '--width' in arguments:
+		width = int( arguments[ arguments.index('--width')+1 ] )
+		if width < 0:
+			sys.exit( "ERROR: --width must be 0 (one line per sequence) or a positive line length" )
+	else:
+		width = None
+	
+	with open_output_file( output_file, '--bgzip' in arguments, threads ) as out:
+		if threads > 1 and not is_compressed_file( input_file ):	#compressed files cannot be split into ranges
+			clean_FASTA_file_parallel( input_file, out, width, threads )
+		else:
+			clean_FASTA_file( input_file, out, width )
 
 
-if '--in' in sys.argv and '--out' in sys.argv:
-	main( sys.argv )
-else:
-	sys.exit( __usage__ )
+if __name__ == '__main__':	#worker processes of the pool must not run main again
+	if '--in' in sys.argv and '--out' in sys.argv:
+		main( sys.argv )
+	else:
+		sys.exit( __usage__ )
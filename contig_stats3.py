@@ -3,8 +3,8 @@
 
 ## based on script contig_stats.py Pucker et al., 2016. doi:10.1371/journal.pone.0164321
 
-import re, sys, os
-from operator import itemgetter
+import re, io, sys, os, json, zlib, queue, shutil, struct, threading, itertools, functools, subprocess, collections, concurrent.futures
+import numpy as np
 
 # --- end of imports --- #
 
@@ -21,165 +21,214 @@ __usage__ = """
 				--min <MIN_CONTIG_LENGTH> [1000]
 				--out <FULL_PATH_TO_OUTPUT_DIRECTORY>
 				--exp <EXPRESSION_FILE(normalized)>
+				--exp_cutoff <PERCENT_OF_EXPRESSION>[,<PERCENT_OF_EXPRESSION>,...] [90]
+				--stats_only (no trimmed FASTA file is written)
+				--header_rules <FILE_WITH_ONE_REGEX_PER_LINE>
+				--genome_size <EXPECTED_GENOME_SIZE_IN_BP> (NGx and LGx)
+				--lengths_only (statistics based on FASTA index without composition)
+				--bgzip (trimmed FASTA file is BGZF compressed)
+				--fai (FASTA index of the input file is written)
+				--threads <NUMBER_OF_PROCESSES_AND_COMPRESSION_THREADS> [1]
+				
+				Comparison of multiple assemblies:
+				python3 contig_stats3.py
+				--in_list <FILE_WITH_ONE_FASTA_PER_LINE> | --in_dir <FOLDER_WITH_FASTA_FILES>
+				
+				optional:
+				--threads <NUMBER_OF_ASSEMBLIES_ANALYZED_IN_PARALLEL> [1]
+				(and all options above)
 				
 				bug reports and feature requests: b.pucker@tu-bs.de
 				Please cite: """ + __citation__ + """
 			"""
 
-def calculate_formal_contig_stats_expX( filename, expX ):
-	"""! @brief calculates some formal stats of the given multiple fasta file (assembly)
+# --- byte values of base classes (upper and lower case) --- #
+A_BYTES = np.frombuffer( b'Aa', dtype=np.uint8 )
+C_BYTES = np.frombuffer( b'Cc', dtype=np.uint8 )
+G_BYTES = np.frombuffer( b'Gg', dtype=np.uint8 )
+T_BYTES = np.frombuffer( b'Tt', dtype=np.uint8 )
+N_BYTES = np.frombuffer( b'Nn', dtype=np.uint8 )
+IUPAC_BYTES = np.frombuffer( b'RYSWKMBDHVryswkmbdhv', dtype=np.uint8 )	#ambiguity codes except N
+SOFT_MASKED_BYTES = np.arange( ord( 'a' ), ord( 'z' ) + 1 )
+
+READ_BLOCK_SIZE = 16 * 1024 * 1024	#compressed bytes per read() call of the gzip reader
+QUEUE_SIZE = 4	#maximal number of decompressed blocks waiting for the parser
+
+BGZF_BLOCK_SIZE = 65280	#uncompressed bytes per BGZF block (like htslib)
+BGZF_EOF = bytes.fromhex( "1f8b08040000000000ff0600424302001b0003000000000000000000" )	#empty block at the end of BGZF files
+
+RANGE_SIZE = 64 * 1024 * 1024	#bytes of the input FASTA file per parallel task (ranges start at headers)
+RANGE_WORKER_CONTEXT = {}	#expression filter and header patterns in worker processes
+
+EXP_CHUNK_SIZE = 100000	#rows of the expression file that are parsed at once
+
+# --- contig name patterns in order of priority; the first match becomes the clean contig name --- #
+HEADER_PATTERNS = [ re.compile( pattern ) for pattern in [ "contig_\\d+", "contig\\d+", "scaffold\\d+", "C\\d+", "NODE_\\d+", "seq\\d+" ] ]
+
+
+def new_contig_collection( composition=True, exp_cutoffs=[] ):
+	"""! @brief creates empty collection of contig lengths and base counts
+	
+		contig_lengths: lengths of all contigs
+		exp_contig_lengths: lengths of all contigs passing the expression filter per expression cutoff
+		base_counts: number of occurrences of each byte value in all contig sequences (None if only lengths are collected)
+		contig_composition: (name, length, GC, AT, N, soft-masked, IUPAC) per contig
+	"""
+	
+	return {	'contig_lengths': [],
+				'exp_contig_lengths': { exp_cutoff: [] for exp_cutoff in exp_cutoffs },
+				'base_counts': np.zeros( 256, dtype=np.int64 ) if composition else None,
+				'contig_composition': []
+			}
+
+
+def merge_contig_collections( collection, other ):
+	"""! @brief add contigs of another collection (of later contigs) to the collection """
+	
+	collection['contig_lengths'] += other['contig_lengths']
+	for exp_cutoff, lengths in other['exp_contig_lengths'].items():
+		collection['exp_contig_lengths'][ exp_cutoff ] += lengths
+	if collection['base_counts'] is not None:
+		collection['base_counts'] += other['base_counts']
+		collection['contig_composition'] += other['contig_composition']
+
+
+def add_contig_to_collection( collection, name, seq, expX, length=None ):
+	"""! @brief counts the bases of one contig (bytes) in bulk and adds it to the collection; only the length is added if the collection has no base counts """
+	
+	if length is None:
+		length = len( seq )
+	if collection['base_counts'] is not None:
+		counts = np.bincount( np.frombuffer( seq, dtype=np.uint8 ), minlength=256 )
+		collection['base_counts'] += counts
+		gc = int( counts[ C_BYTES ].sum() + counts[ G_BYTES ].sum() )
+		at = int( counts[ A_BYTES ].sum() + counts[ T_BYTES ].sum() )
+		collection['contig_composition'].append( (	name, length, gc, at, int( counts[ N_BYTES ].sum() ),
+													int( counts[ SOFT_MASKED_BYTES ].sum() ), int( counts[ IUPAC_BYTES ].sum() ) ) )
+	collection['contig_lengths'].append( length )
+	contig_name = name.split(' ')[0]
+	for exp_cutoff, valid_contigs in expX.items():
+		if contig_name in valid_contigs:
+			collection['exp_contig_lengths'][ exp_cutoff ].append( length )
+
+
+def calculate_nx_curve( contig_lengths, genome_size=None ):
+	"""! @brief calculates Nx and Lx (x = 1..100) based on one sorting of the contig lengths; NGx and LGx are calculated based on the genome size
 	
-		@param filename (string) full path to a assembly output file (multiple fasta file)
+		@param contig_lengths (list) lengths of all contigs
 		
-		@return (dictionary) contains all formal stats of the analyzed assembly
+		@param genome_size (int) expected genome size; NGx and LGx are not calculated if None
 		
-		@author Boas Pucker
+		@return (dictionary) x, Nx, Lx, NGx, LGx (numpy arrays; 0 if the contigs do not reach x percent)
 	"""
 	
-	sys.stdout.write( "calculation of formal assembly stats ... please wait!\n" )
-	sys.stdout.flush()
+	x = np.arange( 1, 101 )
+	sorted_contig_lengths = np.sort( np.asarray( contig_lengths, dtype=np.int64 ) )[::-1]	#invert to get it decreasing
+	cum_lengths = np.cumsum( sorted_contig_lengths ) * 100	#compare integers: cum_length >= x/100 * total
+	padded_lengths = np.append( sorted_contig_lengths, 0 )	#0 if x percent are not reached
 	
-	number_of_bases_without_N = 0	#counts all bases without N
-	number_of_gc = 0		#counts occurences of G or C in sequence
-	contig_lengths = []		#lengths of all contigs in the assembly; used for calculation of min, max and mean
-	exp_contig_lengths = []
-	
-	with open( filename, 'r' ) as f:
-		header = f.readline().strip()[1:]
-		if " " in header:
-			header = header.split(' ')[0]
-		line = f.readline()
-		sequence = []
-		counter = 1
-		while line:
-			if line[0] == '>':	#new header => evaluate current sequence and set back to empty string
-				sequence = "".join( sequence )
-				for base in sequence.upper():
-					if base == 'G' or base == 'C':
-						number_of_gc += 1
-						number_of_bases_without_N += 1
-					elif base == 'A' or base == 'T':
-						number_of_bases_without_N += 1
-				contig_lengths.append( len( sequence ) )
-				try:
-					expX[ header ]
-					exp_contig_lengths.append( len( sequence ) )
-				except KeyError:
-					pass
-				sequence = []
-				header = line.strip()[1:]
-				if " " in header:
-					header = header.split(' ')[0]
-			else:
-				sequence.append( line.strip() )
-			line = f.readline()
-			counter += 1
-			if counter % 1000 == 0:
-				sys.stdout.write( str( counter/1000 ) + ' x1000 lines processed\n' )
-				sys.stdout.flush()
-		#place block from new header here again (for last sequence in file)
-		sequence = "".join( sequence )
-		for base in sequence.upper():
-			if base == 'G' or base == 'C':
-				number_of_gc += 1
-				number_of_bases_without_N += 1
-			elif base == 'A' or base == 'T':
-				number_of_bases_without_N += 1
-		contig_lengths.append( len( sequence ) )
-		try:
-			expX[ header ]
-			exp_contig_lengths.append( len( sequence ) )
-		except KeyError:
-			pass
+	nx_curve = { 'x': x }
+	for n_key, l_key, reference_size in [ ( 'Nx', 'Lx', int( sorted_contig_lengths.sum() ) ), ( 'NGx', 'LGx', genome_size ) ]:
+		if reference_size is None:
+			continue
+		indices = np.searchsorted( cum_lengths, x * reference_size, side='left' )	#first contig reaching x percent
+		nx_curve[ n_key ] = padded_lengths[ indices ]
+		nx_curve[ l_key ] = np.where( indices < len( sorted_contig_lengths ), indices + 1, 0 )
+	return nx_curve
+
+
+def get_nx_value( nx_curve, x, prefix="N" ):
+	"""! @brief returns Nx (or Lx, NGx, LGx with prefix L, NG, LG) value of the curve; False if the contigs do not reach x percent """
+	
+	value = int( nx_curve[ prefix + 'x' ][ x - 1 ] )
+	return value if value > 0 else False
+
+
+def write_nx_curve_file( nx_curve_outputfile, nx_curve ):
+	"""! @brief writes Nx, Lx (and NGx, LGx) for x = 1..100 to a table """
+	
+	columns = [ column for column in [ 'Nx', 'Lx', 'NGx', 'LGx' ] if column in nx_curve ]
+	with open( nx_curve_outputfile, 'w' ) as out:
+		out.write( "x\t" + "\t".join( columns ) + "\n" )
+		for idx, x in enumerate( nx_curve['x'] ):
+			out.write( str( x ) + "\t" + "\t".join( [ str( nx_curve[ column ][ idx ] ) for column in columns ] ) + "\n" )
+
+
+def summarize_contig_stats( collection, genome_size=None ):
+	"""! @brief calculates formal stats from collected contig lengths and base counts
+	
+		@param collection (dictionary) contig lengths and base counts (new_contig_collection)
+		
+		@param genome_size (int) expected genome size for NGx and LGx; not used if None
+		
+		@return (dictionary) contains all formal stats of the analyzed assembly
+	"""
+	
+	contig_lengths = collection['contig_lengths']
+	exp_contig_lengths = collection['exp_contig_lengths']
+	base_counts = collection['base_counts']
 	
 	# --- calculate remaining stats --- #
+	if len( contig_lengths ) == 0:
+		sys.exit( "ERROR: no contigs left for the calculation of assembly stats" )
 	number_of_contigs = len( contig_lengths )	#counts number of contigs / scaffolds in this assembly
 	total_number_of_bases = sum( contig_lengths )	#counts all bases in the assembyl
 	mean_contig_length = total_number_of_bases / number_of_contigs	#average contig lengths
 	minimal_contig_length = min( contig_lengths )
 	maximal_contig_length = max( contig_lengths )
 
-	# --- sort list of contig length decreasing --- #
-	sorted_contig_lengths = sorted( contig_lengths )[::-1]	#invert to get it decreasing
-	N25 = False
-	N50 = False
-	N75 = False
-	N90 = False
-	
-	cum_length = total_number_of_bases
-	
-	for contig_length in sorted_contig_lengths:
-		cum_length -= contig_length
-		if cum_length <= 0.1 * total_number_of_bases:
-			if not N90:
-				N90 = contig_length
-		elif cum_length <= 0.25 * total_number_of_bases:
-			if not N75:
-				N75 = contig_length
-		elif cum_length <= 0.5 * total_number_of_bases:
-			if not N50:
-				N50 = contig_length
-		elif cum_length <= 0.75 * total_number_of_bases:
-			if not N25:
-				N25 = contig_length
-	
-	# --- sort list of expression-filtered contig length decreasing --- #
-	sorted_exp_contig_lengths = sorted( exp_contig_lengths )[::-1]	#invert to get it decreasing
-	EN25 = False
-	EN50 = False
-	EN75 = False
-	EN90 = False
-	
-	total_exp_bases = sum(  exp_contig_lengths )
-	cum_exp_length = sum(  exp_contig_lengths )
-	
-	
-	for contig_length in sorted_exp_contig_lengths:
-		cum_exp_length -= contig_length
-		if cum_exp_length <= 0.1 * total_exp_bases:
-			if not EN90:
-				EN90 = contig_length
-		elif cum_exp_length <= 0.25 * total_exp_bases:
-			if not EN75:
-				EN75 = contig_length
-		elif cum_exp_length <= 0.5 * total_exp_bases:
-			if not EN50:
-				EN50 = contig_length
-		elif cum_exp_length <= 0.75 * total_exp_bases:
-			if not EN25:
-				EN25 = contig_length
-	
+	nx_curve = calculate_nx_curve( contig_lengths, genome_size )
 	
 	stats = { 	'number_of_contigs': number_of_contigs,
 			'mean_contig_length': mean_contig_length,
 			'minimal_contig_length': minimal_contig_length,
 			'maximal_contig_length': maximal_contig_length,
 			'total_number_of_bases': total_number_of_bases,
-			'number_of_bases_without_N': number_of_bases_without_N,
-			'gc_content': float( number_of_gc ) /number_of_bases_without_N,
-			'N25': N25,
-			'N50': N50,
-			'N75': N75,
-			'N90': N90,
-			'EN25': EN25,
-			'EN50': EN50,
-			'EN75': EN75,
-			'EN90': EN90
+			'N25': get_nx_value( nx_curve, 25 ),
+			'N50': get_nx_value( nx_curve, 50 ),
+			'N75': get_nx_value( nx_curve, 75 ),
+			'N90': get_nx_value( nx_curve, 90 ),
+			'L50': get_nx_value( nx_curve, 50, "L" ),
+			'L90': get_nx_value( nx_curve, 90, "L" ),
+			'exp_cutoffs': list( exp_contig_lengths.keys() ),
+			'nx_curve': nx_curve
 		 }
-	
-	sys.stdout.write(  "calculation of formal assembly stats done.\n" )
-	sys.stdout.flush()
+	for exp_cutoff, lengths in exp_contig_lengths.items():	#ExN values, e.g. E90N50
+		exp_nx_curve = calculate_nx_curve( lengths )
+		for x in [ 25, 50, 75, 90 ]:
+			stats[ 'E' + exp_cutoff + 'N' + str( x ) ] = get_nx_value( exp_nx_curve, x )
+	if base_counts is not None:	#composition is not available if only lengths were collected
+		number_of_gc = int( base_counts[ C_BYTES ].sum() + base_counts[ G_BYTES ].sum() )
+		number_of_bases_without_N = number_of_gc + int( base_counts[ A_BYTES ].sum() + base_counts[ T_BYTES ].sum() )	#only A, C, G and T
+		stats.update( {	'number_of_bases_without_N': number_of_bases_without_N,
+						'gc_content': float( number_of_gc ) / number_of_bases_without_N if number_of_bases_without_N > 0 else None,	#None if there is no A, C, G or T
+						'number_of_A': int( base_counts[ A_BYTES ].sum() ),
+						'number_of_C': int( base_counts[ C_BYTES ].sum() ),
+						'number_of_G': int( base_counts[ G_BYTES ].sum() ),
+						'number_of_T': int( base_counts[ T_BYTES ].sum() ),
+						'number_of_N': int( base_counts[ N_BYTES ].sum() ),
+						'number_of_soft_masked': int( base_counts[ SOFT_MASKED_BYTES ].sum() ),
+						'number_of_IUPAC': int( base_counts[ IUPAC_BYTES ].sum() ),
+						'contig_composition': collection['contig_composition']
+					} )
+	if genome_size is not None:
+		stats.update( {	'genome_size': genome_size,
+						'NG50': get_nx_value( nx_curve, 50, "NG" ),
+						'LG50': get_nx_value( nx_curve, 50, "LG" ),
+						'NG90': get_nx_value( nx_curve, 90, "NG" ),
+						'LG90': get_nx_value( nx_curve, 90, "LG" )
+					} )
 	return stats
 
 
-def write_NExp_evaluation_to_file( stats_outputfile, formal_stats, assembly_name, percent_cutoff ):
+def write_NExp_evaluation_to_file( stats_outputfile, formal_stats, assembly_name ):
 	"""! @brief writes all calculated evaluation results to file
 		
 		@param prefix (string) path to the ouput loction of all files
 		
 		@param outputfile (string)) only name of file for result output
 		
-		@param formal_stats (dictionary) contains some statistics about the assembly
+		@param formal_stats (dictionary) contains some statistics about the assembly (ExN values of all cutoffs in formal_stats['exp_cutoffs'])
 		
 		@param assembly_name (string) the name of the currently processed assembly
 	"""
@@ -196,124 +245,861 @@ def write_NExp_evaluation_to_file( stats_outputfile, formal_stats, assembly_name
 		out.write( 'maximal contig length:\t' + str( formal_stats['maximal_contig_length'] ) + '\n\n' )
 		
 		out.write( 'total number of bases:\t' + str( formal_stats['total_number_of_bases'] ) + '\n' )
-		out.write( 'total number of bases without Ns:\t' + str( formal_stats['number_of_bases_without_N'] ) + '\n' )
-		out.write( 'GC content:\t' + str( formal_stats['gc_content'] ) + '\n\n' )
+		if 'gc_content' not in formal_stats:	#only contig lengths were analyzed
+			out.write( '\n' )
+		else:
+			out.write( 'total number of bases without Ns:\t' + str( formal_stats['number_of_bases_without_N'] ) + '\n' )
+			out.write( 'GC content:\t' + ( "NA" if formal_stats['gc_content'] is None else str( formal_stats['gc_content'] ) ) + '\n\n' )
+			
+			out.write( 'number of A:\t' + str( formal_stats['number_of_A'] ) + '\n' )
+			out.write( 'number of C:\t' + str( formal_stats['number_of_C'] ) + '\n' )
+			out.write( 'number of G:\t' + str( formal_stats['number_of_G'] ) + '\n' )
+			out.write( 'number of T:\t' + str( formal_stats['number_of_T'] ) + '\n' )
+			out.write( 'number of N:\t' + str( formal_stats['number_of_N'] ) + '\n' )
+			out.write( 'number of IUPAC ambiguity codes (without N):\t' + str( formal_stats['number_of_IUPAC'] ) + '\n' )
+			out.write( 'number of soft-masked (lowercase) bases:\t' + str( formal_stats['number_of_soft_masked'] ) + '\n\n' )
 		
 		out.write( 'N25:\t' + str( formal_stats['N25'] ) + '\n' )
 		out.write( 'N50:\t' + str( formal_stats['N50'] ) + '\n' )
 		out.write( 'N75:\t' + str( formal_stats['N75'] ) + '\n' )
-		out.write( 'N90:\t' + str( formal_stats['N90'] ) + '\n\n' )
+		out.write( 'N90:\t' + str( formal_stats['N90'] ) + '\n' )
+		out.write( 'L50:\t' + str( formal_stats['L50'] ) + '\n' )
+		out.write( 'L90:\t' + str( formal_stats['L90'] ) + '\n\n' )
+		
+		if 'genome_size' in formal_stats:
+			out.write( 'genome size:\t' + str( formal_stats['genome_size'] ) + '\n' )
+			for key in [ 'NG50', 'LG50', 'NG90', 'LG90' ]:
+				out.write( key + ':\t' + str( formal_stats[ key ] ) + '\n' )
+			out.write( '\n' )
 		
-		out.write( "E" + str( percent_cutoff ) + 'N25:\t' + str( formal_stats['EN25'] ) + '\n' )
-		out.write( "E" + str( percent_cutoff ) + 'N50:\t' + str( formal_stats['EN50'] ) + '\n' )
-		out.write( "E" + str( percent_cutoff ) + 'N75:\t' + str( formal_stats['EN75'] ) + '\n' )
-		out.write( "E" + str( percent_cutoff ) + 'N90:\t' + str( formal_stats['EN90'] ) + '\n\n' )
+		for exp_cutoff in formal_stats['exp_cutoffs']:
+			for x in [ 25, 50, 75, 90 ]:
+				out.write( "E" + exp_cutoff + 'N' + str( x ) + ':\t' + str( formal_stats[ "E" + exp_cutoff + 'N' + str( x ) ] ) + '\n' )
+			out.write( '\n' )
 		
 	sys.stdout.write( "all results written to file.\n" )
 	sys.stdout.flush()
 
 
-def clean_assembly_file( input_file, output_file, cutoff ):
-	"""! @brief removes small contigs and cleans contig name to 'contig_<INTEGER>' """
+def write_contig_composition_file( composition_outputfile, contig_composition ):
+	"""! @brief writes GC content and N content of each contig to file
 	
-	sys.stdout.write( "cleaning contig names and removing small contigs ... please wait!\n" )
-	sys.stdout.flush()
-	with open( output_file, "w" ) as out:
-		with open( input_file, "r" ) as f:
-			line = f.readline()
-			try:
+		@param contig_composition (list) (name, length, GC, AT, N, soft-masked, IUPAC) per contig
+	"""
+	
+	with open( composition_outputfile, 'w' ) as out:
+		out.write( "ContigName\tLength\tGC\tN\tSoftMasked\tIUPAC\n" )
+		for name, length, gc, at, n, soft_masked, iupac in contig_composition:
+			gc_content = "NA" if gc + at == 0 else str( round( float( gc ) / ( gc + at ), 4 ) )	#GC content of A, C, G and T
+			n_content = "NA" if length == 0 else str( round( float( n ) / length, 4 ) )
+			out.write( "\t".join( [ name, str( length ), gc_content, n_content, str( soft_masked ), str( iupac ) ] ) + "\n" )
+
+
+def load_header_rules( rules_file ):
+	"""! @brief load regular expressions for contig name cleaning (one per line in order of priority; lines starting with '#' are ignored)
+	
+		@return (list) precompiled patterns
+	"""
+	
+	patterns = []
+	with open( rules_file, "r" ) as f:
+		for line in f:
+			pattern = line.rstrip( "\r\n" )
+			if len( pattern ) > 0 and pattern[0] != '#':
 				try:
-					try:
-						try:
-							try:
-								try:
-									header = re.findall( "contig_\d+", line )[0]
-								except:
-									header = re.findall( "contig\d+", line )[0]
-							except:
-								header = re.findall( "scaffold\d+", line )[0]
-						except:
-							header = re.findall( "C\d+", line )[0]
-					except:
-						header = re.findall( "NODE_\d+", line )[0]
-				except:
-					header = re.findall( "seq\d+", line )[0]
-			except:
-				header = line.strip()[1:]
-			seq = []
-			while line:
-				if line[0] == '>':
-					seq = "".join( seq )
-					if len( seq ) >= cutoff:
-						out.write( '>' + header + '\n' + seq + '\n' )
-					seq = []
-					try:
-						try:
-							try:
-								try:
-									try:
-										try:
-											header = re.findall( "contig_\d+", line )[0]
-										except:
-											header = re.findall( "contig\d+", line )[0]
-									except:
-										header = re.findall( "scaffold\d+", line )[0]
-								except:
-									header = re.findall( "C\d+", line )[0]
-							except:
-								header = re.findall( "NODE_\d+", line )[0]
-						except:
-							header = re.findall( "seq\d+", line )[0]
-					except:
-						header = line.strip()[1:]
+					patterns.append( re.compile( pattern ) )
+				except re.error as error:
+					sys.exit( "ERROR: invalid header rule '" + pattern + "' in " + rules_file + " (" + str( error ) + ")" )
+	if len( patterns ) == 0:
+		sys.exit( "ERROR: no header rules found in " + rules_file )
+	return patterns
+
+
+def get_clean_contig_name( line, header_patterns=HEADER_PATTERNS ):
+	"""! @brief extracts a clean contig name from a FASTA header line (e.g. 'contig_<INTEGER>'); the complete match of the first matching pattern is used """
+	
+	for pattern in header_patterns:
+		match = pattern.search( line )
+		if match:
+			return match.group( 0 )
+	return line.strip()[1:]
+
+
+def is_compressed_file( filename ):
+	"""! @brief check if file is gzip compressed (including BGZF) based on the first bytes """
+	
+	with open( filename, "rb" ) as f:
+		return f.read( 2 ) == b'\x1f\x8b'
+
+
+def decompress_gzip_block( state, block ):
+	"""! @brief decompress next bytes of a (multi-member) gzip file """
+	
+	data = []
+	while block:
+		data.append( state['decompressor'].decompress( block ) )
+		if state['decompressor'].eof and len( state['decompressor'].unused_data ) > 0:	#next gzip member (e.g. BGZF block)
+			block = state['decompressor'].unused_data
+			state['decompressor'] = zlib.decompressobj( 16 + zlib.MAX_WBITS )
+		else:
+			block = b""
+	return b"".join( data )
+
+
+def put_block( blocks, item, stop ):
+	"""! @brief put item into bounded queue unless the consumer stopped reading """
+	
+	while not stop.is_set():
+		try:
+			blocks.put( item, timeout=0.1 )
+			return
+		except queue.Full:
+			pass
+
+
+def produce_blocks( source, gzip_state, blocks, stop ):
+	"""! @brief read (and decompress) blocks of source and put them into bounded queue; None marks the end of the file """
+	
+	try:
+		state = { 'decompressor': zlib.decompressobj( 16 + zlib.MAX_WBITS ) }
+		while not stop.is_set():
+			raw = source.read( READ_BLOCK_SIZE )
+			if not raw:
+				break
+			block = decompress_gzip_block( state, raw ) if gzip_state else raw
+			if len( block ) > 0:
+				put_block( blocks, block, stop )
+		if gzip_state and not state['decompressor'].eof:
+			raise EOFError( "compressed file ended before the end-of-stream marker was reached" )
+		put_block( blocks, None, stop )
+	except Exception as error:
+		put_block( blocks, error, stop )
+
+
+def read_gzip_blocks( filename ):
+	"""! @brief yield decompressed blocks of gzip file; decompression runs in a separate thread (or in igzip/pigz if available) that hands the blocks to the parser through a bounded queue (like FASTQ_stats3.py) """
+	
+	external = None
+	for tool in [ "igzip", "pigz" ]:
+		if shutil.which( tool ):
+			external = tool
+			break
+	
+	process = None
+	if external is not None:
+		process = subprocess.Popen( [ external, "-dc", filename ], stdout=subprocess.PIPE )
+		source = process.stdout
+	else:
+		source = open( filename, "rb" )
+	
+	blocks = queue.Queue( maxsize=QUEUE_SIZE )
+	stop = threading.Event()
+	producer = threading.Thread( target=produce_blocks, args=( source, external is None, blocks, stop ), daemon=True )
+	producer.start()
+	try:
+		while True:
+			block = blocks.get()
+			if block is None:
+				break
+			if isinstance( block, Exception ):
+				raise block
+			yield block
+		if process is not None and process.wait() != 0:
+			raise OSError( external + " failed to decompress " + filename )
+	finally:
+		stop.set()
+		if process is not None and process.poll() is None:
+			process.kill()
+		producer.join()
+		source.close()
+		if process is not None:
+			process.wait()
+
+
+class GzipBlockStream( io.RawIOBase ):
+	"""! @brief binary file object that reads the decompressed blocks of read_gzip_blocks """
+	
+	def __init__( self, filename ):
+		self.blocks = read_gzip_blocks( filename )
+		self.block = b""
+		self.offset = 0
+	
+	def readable( self ):
+		return True
+	
+	def readinto( self, buffer ):
+		"""! @brief copy the next decompressed bytes into buffer; 0 at the end of the file """
+		
+		while self.offset >= len( self.block ):
+			self.block = next( self.blocks, None )
+			self.offset = 0
+			if self.block is None:
+				self.block = b""
+				return 0
+		size = min( len( buffer ), len( self.block ) - self.offset )
+		buffer[ :size ] = self.block[ self.offset:self.offset + size ]
+		self.offset += size
+		return size
+	
+	def close( self ):
+		if not self.closed:
+			self.blocks.close()	#stops decompression thread or process
+		super().close()
+
+
+def open_FASTA_file( filename ):
+	"""! @brief open FASTA file for reading in binary mode; gzip and BGZF compressed files are decompressed on the fly in a separate thread or process """
+	
+	if is_compressed_file( filename ):
+		return io.BufferedReader( GzipBlockStream( filename ), buffer_size=1024 * 1024 )
+	return open( filename, "rb" )
+
+
+def compress_bgzf_block( data, level=6 ):
+	"""! @brief compresses data into one BGZF block (gzip member with BC extra field); data is split if the block would exceed 64 kb """
+	
+	compressor = zlib.compressobj( level, zlib.DEFLATED, -15 )	#raw deflate
+	deflated = compressor.compress( data ) + compressor.flush()
+	if len( deflated ) + 26 > 65536:
+		half = len( data ) // 2
+		return compress_bgzf_block( data[ :half ], level ) + compress_bgzf_block( data[ half: ], level )
+	header = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00' + struct.pack( '<H', len( deflated ) + 25 )	#block size - 1
+	return header + deflated + struct.pack( '<II', zlib.crc32( data ) & 0xffffffff, len( data ) )
+
+
+class BGZFWriter( object ):
+	"""! @brief file object for writing BGZF compressed files (indexable by samtools faidx); blocks are compressed in parallel threads """
+	
+	def __init__( self, filename, threads=1, level=6 ):
+		self.out = open( filename, "wb" )
+		self.level = level
+		self.threads = max( 1, threads )
+		self.buffer = bytearray()
+		self.executor = concurrent.futures.ThreadPoolExecutor( max_workers=self.threads ) if self.threads > 1 else None
+	
+	def write( self, data ):
+		self.buffer += data
+		if len( self.buffer ) >= BGZF_BLOCK_SIZE * self.threads * 4:
+			self.write_blocks( final=False )
+		return len( data )
+	
+	def write_blocks( self, final ):
+		"""! @brief compresses all complete blocks in the buffer (and the incomplete last block if final) and writes them in order """
+		
+		end = len( self.buffer ) if final else len( self.buffer ) - len( self.buffer ) % BGZF_BLOCK_SIZE
+		chunks = [ bytes( self.buffer[ start:min( start + BGZF_BLOCK_SIZE, end ) ] ) for start in range( 0, end, BGZF_BLOCK_SIZE ) ]
+		del self.buffer[ :end ]
+		if self.executor is not None:	#zlib releases the GIL during compression
+			blocks = self.executor.map( functools.partial( compress_bgzf_block, level=self.level ), chunks )
+		else:
+			blocks = map( functools.partial( compress_bgzf_block, level=self.level ), chunks )
+		for block in blocks:
+			self.out.write( block )
+	
+	def close( self ):
+		if self.out.closed:
+			return
+		self.write_blocks( final=True )
+		self.out.write( BGZF_EOF )
+		self.out.close()
+		if self.executor is not None:
+			self.executor.shutdown()
+	
+	def __enter__( self ):
+		return self
+	
+	def __exit__( self, exc_type, exc_value, traceback ):
+		self.close()
+
+
+def open_output_file( filename, bgzip=False, threads=1 ):
+	"""! @brief open output file in binary mode; BGZF compression is used if requested or if the filename ends with .gz or .bgz """
+	
+	if bgzip or filename.endswith( ( ".gz", ".bgz" ) ):
+		return BGZFWriter( filename, threads )
+	return open( filename, "wb" )
+
+
+def get_fai_entry( header, seq, lines, offset ):
+	"""! @brief generates FASTA index entry (samtools faidx format) of one record
+	
+		@param lines (list) raw sequence lines of the record (including line breaks)
+		
+		@param offset (int) position of the first sequence byte in the file
+		
+		@return (tuple) name, length, offset, bases per line, bytes per line; None if the lines have different lengths
+	"""
+	
+	name = ( header[1:].split() or [ b"" ] )[0].decode()
+	if len( lines ) == 0:
+		return ( name, 0, offset, 0, 0 )
+	linewidth = len( lines[0] )
+	linebases = len( lines[0].rstrip( b'\r\n' ) )
+	if len( set( map( len, lines[:-1] ) ) ) > 1 or len( seq ) != ( len( lines ) - 1 ) * linebases + len( lines[-1].rstrip( b'\r\n' ) ) or len( lines[-1].rstrip( b'\r\n' ) ) > linebases:
+		return None
+	return ( name, len( seq ), offset, linebases, linewidth )
+
+
+def iter_FASTA_records( f, fai_entries=None ):
+	"""! @brief yields header line, sequence and length of all records of a FASTA file (binary mode)
+	
+		@param fai_entries (list) index entries of all records are appended to this list if provided (None for records with irregular line lengths)
+	"""
+	
+	header, lines, offset, position = None, [], 0, 0
+	for line in itertools.chain( f, [ b'>' ] ):	#last line triggers output of the last record
+		position += len( line )
+		if line[:1] == b'>':
+			if header is not None:
+				seq = b"".join( [ each.strip() for each in lines ] )
+				if fai_entries is not None:
+					fai_entries.append( get_fai_entry( header, seq, lines, offset ) )
+				yield header, seq, len( seq )
+			header, lines, offset = line, [], position
+		else:
+			lines.append( line )
+
+
+def iter_indexed_FASTA_records( f, fai_entries, cutoff, read_sequences ):
+	"""! @brief yields header line, sequence (None if not read_sequences) and length of all records reaching the cutoff; other records are skipped based on the FASTA index """
+	
+	record_end = 0
+	for name, length, offset, linebases, linewidth in fai_entries:
+		header_start = record_end	#header line follows the end of the previous record
+		if linebases > 0:
+			record_end = offset + length + ( ( length + linebases - 1 ) // linebases ) * ( linewidth - linebases )
+		else:
+			record_end = offset
+		if length < cutoff:
+			continue
+		f.seek( header_start )
+		header = f.read( offset - header_start ).strip().split( b'\n' )[-1]
+		seq = None
+		if read_sequences:
+			seq = f.read( record_end - offset ).translate( None, b'\r\n' )
+		yield header, seq, length
+
+
+def load_fai_index( fasta_file, fai_file=None ):
+	"""! @brief loads FASTA index if it exists and is not older than the FASTA file
+	
+		@param fai_file (string) FASTA index file (<FASTA>.fai if None)
+		
+		@return (list) entries (name, length, offset, bases per line, bytes per line); None if no valid index is available
+	"""
+	
+	if fai_file is None:
+		fai_file = fasta_file + ".fai"
+	if not os.path.isfile( fai_file ) or os.path.getmtime( fai_file ) < os.path.getmtime( fasta_file ):
+		return None
+	fai_entries = []
+	with open( fai_file, "r" ) as f:
+		for line in f:
+			parts = line.rstrip( "\r\n" ).split( "\t" )
+			try:
+				fai_entries.append( ( parts[0], int( parts[1] ), int( parts[2] ), int( parts[3] ), int( parts[4] ) ) )
+			except ( IndexError, ValueError ):
+				sys.stdout.write( "WARNING: FASTA index " + fai_file + " is invalid and will be ignored.\n" )
+				sys.stdout.flush()
+				return None
+	return fai_entries
+
+
+def write_fai_index( fai_file, fasta_file, fai_entries ):
+	"""! @brief writes FASTA index of fasta_file to fai_file if all records have regular line lengths; a warning is given if the index cannot be written """
+	
+	if None in fai_entries:
+		sys.stdout.write( "WARNING: FASTA index was not written, because line lengths differ within records of " + fasta_file + "\n" )
+		sys.stdout.flush()
+		return
+	try:
+		with open( fai_file + ".tmp", "w" ) as out:
+			for entry in fai_entries:
+				out.write( "\t".join( map( str, entry ) ) + "\n" )
+		os.replace( fai_file + ".tmp", fai_file )
+	except OSError as error:
+		sys.stdout.write( "WARNING: FASTA index " + fai_file + " could not be written (" + str( error ) + ")\n" )
+		sys.stdout.flush()
+
+
+def build_fai_index( fasta_file ):
+	"""! @brief generates FASTA index in one pass over the FASTA file
+	
+		@return (list) index entries (None for records with irregular line lengths)
+	"""
+	
+	sys.stdout.write( "building FASTA index ... please wait!\n" )
+	sys.stdout.flush()
+	fai_entries = []
+	with open( fasta_file, "rb" ) as f:
+		for record in iter_FASTA_records( f, fai_entries ):
+			pass
+	return fai_entries
+
+
+def clean_and_filter_records( records, cutoff, expX, header_patterns, collection, out, contig_names, report_progress=True ):
+	"""! @brief cleans contig names, removes small contigs, writes the remaining contigs and adds them to the collection
+	
+		@param records (iterable) header line, sequence (bytes; None if not read) and length of each record
+		
+		@param out (file object) trimmed assembly; no FASTA file is written if None
+		
+		@param contig_names (list) original name and clean name of all remaining contigs are appended to this list
+	"""
+	
+	for header_line, seq, length in records:
+		if length < cutoff:
+			continue
+		header_line = header_line.decode()
+		header = get_clean_contig_name( header_line, header_patterns )
+		if out is not None:
+			out.write( b'>' + header.encode() + b'\n' + seq + b'\n' )
+		contig_names.append( ( ( header_line[1:].split() or [ "" ] )[0], header ) )
+		add_contig_to_collection( collection, header, seq, expX, length )
+		if report_progress and len( contig_names ) % 100000 == 0:
+			sys.stdout.write( str( len( contig_names ) / 1000 ) + ' x1000 contigs processed\n' )
+			sys.stdout.flush()
+
+
+def get_record_aligned_ranges( filename, range_size=RANGE_SIZE ):
+	"""! @brief splits a FASTA file into byte ranges of about range_size that start at a header line
+	
+		@return (list) start and end position of all ranges
+	"""
+	
+	file_size = os.path.getsize( filename )
+	starts = [ 0 ]
+	with open( filename, "rb" ) as f:
+		while starts[-1] + range_size < file_size:
+			position = starts[-1] + range_size - 1	#include preceding byte to find line breaks right before the target position
+			next_start = None
+			while next_start is None:
+				f.seek( position )
+				chunk = f.read( 1048576 )
+				if len( chunk ) < 2:
+					break
+				idx = chunk.find( b'\n>' )
+				if idx >= 0:
+					next_start = position + idx + 1
 				else:
-					seq.append( line.strip() )
-				line = f.readline()
-			seq = "".join( seq )
-			if len( seq ) >= cutoff:
-				out.write( '>' + header + '\n' + seq + '\n' )
+					position += len( chunk ) - 1	#'\n>' can span two chunks
+			if next_start is None:	#no further header
+				break
+			starts.append( next_start )
+	return list( zip( starts, starts[1:] + [ file_size ] ) )
+
+
+def map_in_order( executor, function, arguments, window ):
+	"""! @brief like executor.map, but at most window tasks are submitted ahead of the consumed result (bounded memory) """
+	
+	futures = collections.deque()
+	for argument in arguments:
+		futures.append( executor.submit( function, *argument ) )
+		if len( futures ) >= window:
+			yield futures.popleft().result()
+	while len( futures ) > 0:
+		yield futures.popleft().result()
 
 
-def load_expression( exp_file, percent_cutoff ):
-	"""! @brief load expression """
+def init_range_worker( expX, header_patterns ):
+	"""! @brief stores data that is shared by all tasks in a worker process (sent only once per process) """
 	
-	# --- load expression --- #
-	exp = {}
+	RANGE_WORKER_CONTEXT.update( { 'expX': expX, 'header_patterns': header_patterns } )
+
+
+def analyze_FASTA_range( input_file, start, end, cutoff, write_sequences, collect_index ):
+	"""! @brief cleans, filters and analyzes all records in one byte range of a FASTA file (worker of the parallel mode)
+	
+		@return (tuple) trimmed FASTA (bytes; None if not write_sequences), contig names, contig collection, index entries (None if not collect_index)
+	"""
+	
+	expX = RANGE_WORKER_CONTEXT['expX']
+	with open( input_file, "rb" ) as f:
+		f.seek( start )
+		data = f.read( end - start )
+	fai_entries = [] if collect_index else None
+	out = io.BytesIO() if write_sequences else None
+	collection = new_contig_collection( exp_cutoffs=expX.keys() )
+	contig_names = []
+	records = iter_FASTA_records( io.BytesIO( data ), fai_entries )
+	clean_and_filter_records( records, cutoff, expX, RANGE_WORKER_CONTEXT['header_patterns'], collection, out, contig_names, report_progress=False )
+	if collect_index:	#offsets in the file instead of the range
+		fai_entries = [ None if entry is None else ( entry[0], entry[1], entry[2] + start, entry[3], entry[4] ) for entry in fai_entries ]
+	return ( None if out is None else out.getvalue() ), contig_names, collection, fai_entries
+
+
+def clean_and_analyze_assembly_file( input_file, output_file, cutoff, expX, header_patterns=HEADER_PATTERNS, mapping_file=None, genome_size=None, fai_entries=None, fai_file=None, bgzip=False, threads=1 ):
+	"""! @brief cleans contig names, removes small contigs and calculates formal stats of the remaining contigs in a single pass
+	
+		@param input_file (string) raw assembly file (multiple fasta file; can be gzip or BGZF compressed)
+		
+		@param output_file (string) trimmed assembly file; no FASTA file is written if None (stats only); BGZF compressed if bgzip or if the name ends with .gz/.bgz
+		
+		@param cutoff (int) minimal contig length
+		
+		@param expX (dictionary) contig names passing the expression filter per expression cutoff (e.g. '90')
+		
+		@param header_patterns (list) precompiled patterns for contig name cleaning
+		
+		@param mapping_file (string) table of original and clean names of all written contigs; not written if None
+		
+		@param genome_size (int) expected genome size for NGx and LGx; not used if None
+		
+		@param fai_entries (list) FASTA index; only contig lengths are analyzed and only sequences of written contigs are read if provided
+		
+		@param fai_file (string) FASTA index of the input file written as by-product of the pass over all sequences (uncompressed input only); not written if None
+		
+		@param threads (int) number of processes for record-aligned ranges of uncompressed input and threads for BGZF compression
+		
+		@return (dictionary) contains all formal stats of the trimmed assembly
+	"""
+	
+	sys.stdout.write( "cleaning assembly and calculating formal assembly stats ... please wait!\n" )
+	sys.stdout.flush()
+	
+	collection = new_contig_collection( composition=fai_entries is None, exp_cutoffs=expX.keys() )
+	contig_names = []
+	new_fai_entries = [] if fai_file is not None else None
+	
+	out = None if output_file is None else open_output_file( output_file, bgzip, threads )
+	try:
+		if threads > 1 and fai_entries is None and not is_compressed_file( input_file ):	#parallel processing of ranges; output is identical to the serial mode
+			ranges = get_record_aligned_ranges( input_file )
+			worker = functools.partial( analyze_FASTA_range, input_file, cutoff=cutoff, write_sequences=out is not None, collect_index=fai_file is not None )
+			with concurrent.futures.ProcessPoolExecutor( max_workers=threads, initializer=init_range_worker, initargs=( expX, header_patterns ) ) as executor:
+				for range_fasta, range_contig_names, range_collection, range_fai_entries in map_in_order( executor, worker, ranges, threads * 2 ):
+					if out is not None:
+						out.write( range_fasta )
+					contig_names += range_contig_names
+					merge_contig_collections( collection, range_collection )
+					if fai_file is not None:
+						new_fai_entries += range_fai_entries
+					sys.stdout.write( str( len( contig_names ) / 1000 ) + ' x1000 contigs processed\n' )
+					sys.stdout.flush()
+		else:
+			with open_FASTA_file( input_file ) as f:
+				if fai_entries is None:
+					records = iter_FASTA_records( f, new_fai_entries )
+				else:
+					records = iter_indexed_FASTA_records( f, fai_entries, cutoff, out is not None )
+				clean_and_filter_records( records, cutoff, expX, header_patterns, collection, out, contig_names )
+	finally:
+		if out is not None:
+			out.close()
+	if fai_file is not None:
+		write_fai_index( fai_file, input_file, new_fai_entries )
+	
+	if mapping_file is not None:
+		with open( mapping_file, "w" ) as mapping:
+			mapping.write( "OriginalName\tCleanName\n" )
+			for original_name, header in contig_names:
+				mapping.write( original_name + "\t" + header + "\n" )
+	
+	clean_names = set( [] )
+	duplicated_names = []
+	for original_name, header in contig_names:
+		if header in clean_names:
+			duplicated_names.append( header )
+		else:
+			clean_names.add( header )
+	if len( duplicated_names ) > 0:
+		sys.stdout.write( "WARNING: " + str( len( duplicated_names ) ) + " contigs have a clean name that was already used (e.g. " + duplicated_names[0] + "). Please check the header rules.\n" )
+		sys.stdout.flush()
+	
+	stats = summarize_contig_stats( collection, genome_size )
+	
+	sys.stdout.write(  "cleaning assembly and calculation of formal assembly stats done.\n" )
+	sys.stdout.flush()
+	return stats
+
+
+def load_expression_values( exp_file ):
+	"""! @brief load average expression of all contigs; rows are parsed in chunks into numpy arrays
+	
+		@param exp_file (string) expression file (header line, contig name and expression values per row, tab-separated)
+		
+		@return (list, numpy array) contig names and average expression values
+	"""
+	
+	names = []
+	averages = []
 	with open( exp_file, "r" ) as f:
 		f.readline()	#remove header
-		line = f.readline()
-		while line:
-			parts = line.strip().split('\t')
-			value = sum( map( float, parts[1:] ) ) / len( parts[1:] )
-			exp.update( { parts[0]: value } )
-			line = f.readline()
-	
-	# --- get top X % of contigs based on expression --- #
-	genes_for_sorting = []
-	for key in exp.keys():
-		genes_for_sorting.append( { 'contig': key, 'val': exp[ key ] } )
-	total_exp = sum( exp.values() )
-	cutoff = ( total_exp / 100.0 ) * percent_cutoff
-	contigs_sorted_by_exp = sorted( genes_for_sorting, key=itemgetter('val') )[::-1]
-	valid_contigs = {}
-	counter = 0
-	
-	for each in contigs_sorted_by_exp:
-		if counter < cutoff:
-			counter += each['val']
-			valid_contigs.update( { each['contig']: None } )
+		while True:
+			lines = list( itertools.islice( f, EXP_CHUNK_SIZE ) )
+			if len( lines ) == 0:
+				break
+			chunk_values = []
+			for line in lines:
+				parts = line.strip().split( '\t', 1 )
+				if len( parts ) == 2:	#rows without expression values are ignored
+					names.append( parts[0] )
+					chunk_values.append( parts[1] )
+			if len( chunk_values ) == 0:
+				continue
+			try:
+				averages.append( np.loadtxt( chunk_values, delimiter='\t', ndmin=2 ).mean( axis=1 ) )
+			except ValueError:	#rows with different numbers of values
+				values_per_row = np.array( [ each.count( '\t' ) + 1 for each in chunk_values ] )
+				try:
+					values = np.array( "\t".join( chunk_values ).split( '\t' ), dtype=np.float64 )
+				except ValueError as error:
+					sys.exit( "ERROR: invalid expression value in " + exp_file + " (" + str( error ) + ")" )
+				row_starts = np.concatenate( ( [ 0 ], np.cumsum( values_per_row )[:-1] ) )
+				averages.append( np.add.reduceat( values, row_starts ) / values_per_row )
+	if len( averages ) == 0:
+		return names, np.zeros( 0 )
+	return names, np.concatenate( averages )
+
+
+def get_top_expressed_contigs( names, values, percent_cutoffs ):
+	"""! @brief get contigs with highest expression that make up percent_cutoff of the total expression
+	
+		Only the top contigs required for the largest cutoff are sorted (partial sort of a growing top fraction).
+		Contigs with the same expression are sorted in reverse order of the expression file (like the previous sorted(...)[::-1] selection).
+		
+		@param percent_cutoffs (list) cutoffs (percent of total expression)
+		
+		@return (list) dictionaries with names of valid contigs per cutoff
+	"""
+	
+	total_exp = float( np.cumsum( values )[-1] ) if len( values ) > 0 else 0.0	#sequential sum in file order
+	cutoffs = [ ( total_exp / 100.0 ) * percent_cutoff for percent_cutoff in percent_cutoffs ]
+	number = min( len( values ), 1024 )
+	while True:
+		if number < len( values ):
+			threshold = np.partition( values, len( values ) - number )[ len( values ) - number ]
+			top = np.flatnonzero( values >= threshold )	#all contigs with the threshold expression are included
 		else:
-			return valid_contigs
-	return valid_contigs
+			top = np.arange( len( values ) )
+		top = top[ np.lexsort( ( top, values[ top ] ) )[::-1] ]	#decreasing expression; ties in reverse file order
+		exp_before = np.concatenate( ( [ 0.0 ], np.cumsum( values[ top ] )[:-1] ) )	#expression of all higher expressed contigs
+		if number == len( values ) or exp_before[-1] >= max( cutoffs ):	#all valid contigs are in the sorted top fraction
+			break
+		number = min( len( values ), number * 4 )
+	
+	all_valid_contigs = []
+	for cutoff in cutoffs:
+		number_of_valid_contigs = np.searchsorted( exp_before, cutoff, side='left' )	#contig is added while the expression of higher expressed contigs is below the cutoff
+		all_valid_contigs.append( { names[ idx ]: None for idx in top[ :number_of_valid_contigs ] } )
+	return all_valid_contigs
+
+
+def analyze_assembly( raw_assembly_file, output_dir, cutoff, expX, header_patterns, genome_size, stats_only, lengths_only, bgzip=False, threads=1, label=None, write_index=False ):
+	"""! @brief cleans and analyzes one assembly and writes all result files
+	
+		@param output_dir (string) folder for all result files; files are placed next to the assembly file if None
+		
+		@param label (string) unique name of the assembly for the result files in output_dir (file name if None)
+		
+		@param bgzip (bool) write BGZF compressed trimmed FASTA file (using threads for compression)
+		
+		@param write_index (bool) write FASTA index of the assembly file (<LABEL>.fai in output_dir or <FASTA>.fai next to the assembly file)
+		
+		@return (dictionary) formal stats of the assembly (without per contig composition)
+	"""
+	
+	if label is None:
+		label = raw_assembly_file.split('/')[-1]
+	if output_dir is not None:
+		clean_assembly_filename = output_dir + label + '_trimmed.fasta'
+		stats_outputfile = output_dir + label + '_stats.txt'
+	else:
+		clean_assembly_filename = raw_assembly_file + '_trimmed.fasta'
+		stats_outputfile = clean_assembly_filename.replace( "_trimmed.fasta", "_stats.txt" )
+	composition_outputfile = stats_outputfile[:-len( "_stats.txt" )] + "_contig_composition.txt"
+	mapping_outputfile = stats_outputfile[:-len( "_stats.txt" )] + "_name_mapping.txt"
+	nx_curve_outputfile = stats_outputfile[:-len( "_stats.txt" )] + "_Nx.txt"
+	if bgzip:
+		clean_assembly_filename += ".gz"
+	fai_file = ( raw_assembly_file if output_dir is None else output_dir + label ) + ".fai"
+	
+	# --- use FASTA index (.fai) for length statistics or write it as by-product (only if requested) --- #
+	if is_compressed_file( raw_assembly_file ):	#index offsets refer to uncompressed files
+		if lengths_only or write_index:
+			sys.stdout.write( "WARNING: --lengths_only and --fai are not available for compressed FASTA files. All sequences of " + raw_assembly_file + " are analyzed.\n" )
+			sys.stdout.flush()
+		fai_entries, write_index = None, False
+	elif lengths_only:
+		fai_entries = load_fai_index( raw_assembly_file ) or load_fai_index( raw_assembly_file, fai_file )	#index of samtools faidx or of a previous run
+		if fai_entries is None:
+			fai_entries = build_fai_index( raw_assembly_file )
+			if write_index:
+				write_fai_index( fai_file, raw_assembly_file, fai_entries )
+		if None in fai_entries:
+			sys.exit( "ERROR: --lengths_only requires a FASTA file with regular line lengths" )
+		write_index = False
+	else:
+		write_index = write_index and load_fai_index( raw_assembly_file, fai_file ) is None
+		fai_entries = None	#composition requires all sequences
+	
+	# --- cleaning assembly and calculating assembly stats in one pass --- #
+	if stats_only:
+		formal_assembly_stats = clean_and_analyze_assembly_file( raw_assembly_file, None, cutoff, expX, header_patterns, None, genome_size, fai_entries, fai_file if write_index else None, threads=threads )
+	else:
+		formal_assembly_stats = clean_and_analyze_assembly_file( raw_assembly_file, clean_assembly_filename, cutoff, expX, header_patterns, mapping_outputfile, genome_size, fai_entries, fai_file if write_index else None, bgzip, threads )
+	assembly_name = '.'.join( clean_assembly_filename.split('/')[-1].replace( ".fasta.gz", ".fasta" ).split('.')[:-1] )	
+	
+	# ---- write all results of the evaluation to file --- #
+	write_NExp_evaluation_to_file( stats_outputfile, formal_assembly_stats, assembly_name )
+	if 'contig_composition' in formal_assembly_stats:
+		write_contig_composition_file( composition_outputfile, formal_assembly_stats.pop( 'contig_composition' ) )
+	write_nx_curve_file( nx_curve_outputfile, formal_assembly_stats['nx_curve'] )
+	return formal_assembly_stats
+
+
+def get_FASTA_files( directory ):
+	"""! @brief get sorted list of all FASTA files in given directory (trimmed FASTA files generated by this script are excluded) """
+	
+	if directory[-1] != '/':
+		directory += "/"
+	extensions = [ ".fa", ".fasta", ".fna", ".fas" ]
+	extensions += [ extension + ".gz" for extension in extensions ]
+	FASTA_files = []
+	for filename in sorted( os.listdir( directory ) ):
+		if os.path.isfile( directory + filename ) and filename.endswith( tuple( extensions ) ) and not filename.endswith( ( "_trimmed.fasta", "_trimmed.fasta.gz" ) ):
+			FASTA_files.append( directory + filename )
+	return FASTA_files
+
+
+def load_FASTA_file_list( list_file ):
+	"""! @brief load FASTA filenames (one per line; empty lines and lines starting with '#' are ignored) """
+	
+	FASTA_files = []
+	with open( list_file, "r" ) as f:
+		for line in f:
+			filename = line.strip()
+			if len( filename ) > 0 and filename[0] != '#':
+				if not os.path.isfile( filename ):
+					sys.exit( "ERROR: FASTA file not found: " + filename )
+				FASTA_files.append( filename )
+	return FASTA_files
+
+
+def get_assembly_labels( assembly_files ):
+	"""! @brief get unique names of assemblies for result files and comparison tables
+	
+		@return (list) file names; paths relative to the common folder if file names are not unique (and a number prefix if they are still not unique)
+	"""
+	
+	labels = [ filename.split('/')[-1] for filename in assembly_files ]
+	if len( set( labels ) ) < len( labels ):
+		paths = [ os.path.abspath( filename ) for filename in assembly_files ]
+		common_dir = os.path.commonpath( [ os.path.dirname( path ) for path in paths ] )
+		labels = [ os.path.relpath( path, common_dir ).replace( '/', '_' ) for path in paths ]
+	label_counts = collections.Counter( labels )
+	return [ str( idx + 1 ) + "_" + label if label_counts[ label ] > 1 else label for idx, label in enumerate( labels ) ]
+
+
+def analyze_assemblies( assembly_files, labels, threads, **kwargs ):
+	"""! @brief analyzes assemblies in a pool of processes (keyword arguments of analyze_assembly); all threads are used for compression if there is only one assembly
+	
+		@param labels (list) unique names of the assemblies (get_assembly_labels)
+		
+		@return (list) formal stats of all assemblies in the order of the input files (None if the analysis of an assembly failed)
+	"""
+	
+	worker = functools.partial( analyze_assembly, threads=threads if len( assembly_files ) == 1 else 1, **kwargs )
+	if len( assembly_files ) == 1:	#errors of a single assembly end the script
+		return [ worker( assembly_files[0], label=labels[0] ) ]
+	
+	all_stats = []
+	if threads > 1:
+		with concurrent.futures.ProcessPoolExecutor( max_workers=threads ) as executor:
+			futures = [ executor.submit( worker, filename, label=label ) for filename, label in zip( assembly_files, labels ) ]
+			for filename, future in zip( assembly_files, futures ):
+				try:
+					all_stats.append( future.result() )
+				except ( Exception, SystemExit ) as error:
+					all_stats.append( None )
+					sys.stdout.write( "WARNING: analysis of " + filename + " failed (" + repr( error ) + "). Assembly is not included in the comparison.\n" )
+					sys.stdout.flush()
+	else:
+		for filename, label in zip( assembly_files, labels ):
+			try:
+				all_stats.append( worker( filename, label=label ) )
+			except ( Exception, SystemExit ) as error:
+				all_stats.append( None )
+				sys.stdout.write( "WARNING: analysis of " + filename + " failed (" + repr( error ) + "). Assembly is not included in the comparison.\n" )
+				sys.stdout.flush()
+	return all_stats
+
+
+def write_assembly_comparison( comparison_prefix, assembly_files, labels, all_stats ):
+	"""! @brief writes comparison table (TSV and JSON) of all assemblies """
+	
+	columns = [	'number_of_contigs', 'total_number_of_bases', 'mean_contig_length', 'minimal_contig_length', 'maximal_contig_length',
+				'N25', 'N50', 'N75', 'N90', 'L50', 'L90', 'NG50', 'LG50', 'NG90', 'LG90',
+				'number_of_bases_without_N', 'gc_content', 'number_of_N', 'number_of_IUPAC', 'number_of_soft_masked' ]
+	for exp_cutoff in all_stats[0]['exp_cutoffs']:
+		columns += [ "E" + exp_cutoff + "N" + str( x ) for x in [ 25, 50, 75, 90 ] ]
+	columns = [ column for column in columns if any( column in stats for stats in all_stats ) ]
+	
+	with open( comparison_prefix + ".txt", "w" ) as out:
+		out.write( "Assembly\t" + "\t".join( columns ) + "\n" )
+		for label, stats in zip( labels, all_stats ):
+			out.write( label + "\t" + "\t".join( [ "NA" if stats.get( column ) is None else str( stats[ column ] ) for column in columns ] ) + "\n" )
+	
+	comparison = []
+	for filename, label, stats in zip( assembly_files, labels, all_stats ):
+		entry = { 'assembly': label, 'file': filename }
+		for column in columns:
+			entry[ column ] = stats.get( column, None )
+		entry['Nx'] = [ int( value ) for value in stats['nx_curve']['Nx'] ]
+		comparison.append( entry )
+	with open( comparison_prefix + ".json", "w" ) as out:
+		json.dump( comparison, out, indent=1 )
+
+
+def generate_nx_figure( fig_file, labels, all_stats ):
+	"""! @brief generates combined Nx plot of all assemblies (matplotlib is only imported here) """
+	
+	try:
+		import matplotlib
+		matplotlib.use( "Agg" )
+		import matplotlib.pyplot as plt
+	except ImportError:
+		sys.stdout.write( "WARNING: matplotlib is required for the Nx plot. Plot is skipped.\n" )
+		sys.stdout.flush()
+		return
+	
+	fig, ax = plt.subplots( figsize=( 8, 5 ) )
+	for label, stats in zip( labels, all_stats ):
+		ax.step( stats['nx_curve']['x'], stats['nx_curve']['Nx'] / 1000.0, where="post", label=label )
+	ax.set_xlabel( "x [%]" )
+	ax.set_ylabel( "Nx [kb]" )
+	ax.set_xlim( 0, 100 )
+	if len( labels ) <= 20:
+		ax.legend( fontsize=6 )
+	else:
+		ax.legend( fontsize=4, ncol=2 )
+	plt.tight_layout()
+	fig.savefig( fig_file, dpi=300 )
+	plt.close( fig )
 
 
 def main( arguments ):
 	"""! @brief runs all parts of this script """
 	
-	if '--input' in arguments:
-		raw_assembly_file = arguments[ arguments.index( '--input' ) + 1 ]
+	if '--in_list' in arguments:
+		assembly_list_file = arguments[ arguments.index( '--in_list' ) + 1 ]
+		assembly_files = load_FASTA_file_list( assembly_list_file )
+		comparison_dir = os.path.dirname( os.path.abspath( assembly_list_file ) ) + "/"
+	elif '--in_dir' in arguments:
+		assembly_dir = arguments[ arguments.index( '--in_dir' ) + 1 ]
+		assembly_files = get_FASTA_files( assembly_dir )
+		comparison_dir = assembly_dir if assembly_dir[-1] == '/' else assembly_dir + "/"
+	elif '--input' in arguments:
+		assembly_files = [ arguments[ arguments.index( '--input' ) + 1 ] ]
+	else:
+		assembly_files = [ arguments[ arguments.index( '--in' ) + 1 ] ]
+	if len( assembly_files ) == 0:
+		sys.exit( "ERROR: no FASTA files found" )
+	
+	if '--threads' in arguments:
+		threads = int( arguments[ arguments.index( '--threads' ) + 1 ] )
 	else:
-		raw_assembly_file = arguments[ arguments.index( '--in' ) + 1 ]
+		threads = 1
 	
 	if '--min_contig_len' in arguments:
 		cutoff = int( arguments[ arguments.index( '--min_contig_len' ) + 1 ] )
@@ -328,34 +1114,57 @@ def main( arguments ):
 			output_dir += "/"
 		if not os.path.exists( output_dir ):
 			os.makedirs( output_dir )
-		clean_assembly_filename = output_dir + raw_assembly_file.split('/')[-1] + '_trimmed.fasta'
-		stats_outputfile = output_dir + raw_assembly_file.split('/')[-1] + '_stats.txt'
 	else:
-		clean_assembly_filename = raw_assembly_file + '_trimmed.fasta'
-		stats_outputfile = clean_assembly_filename.replace( "_trimmed.fasta", "_stats.txt" )
+		output_dir = None
+	
+	if '--genome_size' in arguments:
+		genome_size = int( arguments[ arguments.index( '--genome_size' ) + 1 ] )
+		if genome_size <= 0:
+			sys.exit( "ERROR: --genome_size must be a positive number of bases" )
+	else:
+		genome_size = None
+	
+	if '--header_rules' in arguments:
+		header_patterns = load_header_rules( arguments[ arguments.index( '--header_rules' ) + 1 ] )
+	else:
+		header_patterns = HEADER_PATTERNS
+	
+	if '--exp_cutoff' in arguments:
+		exp_cutoffs = arguments[ arguments.index( '--exp_cutoff' ) + 1 ].split(',')
+		try:
+			percent_cutoffs = [ float( exp_cutoff ) for exp_cutoff in exp_cutoffs ]
+		except ValueError:
+			sys.exit( "ERROR: --exp_cutoff must be a comma-separated list of percentages" )
+	else:
+		exp_cutoffs = [ "90" ]
+		percent_cutoffs = [ 90.0 ]
 	
 	if '--exp' in arguments:
 		exp_file = arguments[ arguments.index( '--exp' ) + 1 ]
-		percent_cutoff = 90
-		expX = load_expression( exp_file, percent_cutoff )
+		names, values = load_expression_values( exp_file )
+		expX = dict( zip( exp_cutoffs, get_top_expressed_contigs( names, values, percent_cutoffs ) ) )
 	else:
-		percent_cutoff = 90
-		expX = {}
-	
-	# --- cleaning assembly --- #
-	clean_assembly_file( raw_assembly_file, clean_assembly_filename, cutoff )
+		expX = { exp_cutoff: {} for exp_cutoff in exp_cutoffs }
 	
-	# --- calculating assembly stats --- #
-	formal_assembly_stats = calculate_formal_contig_stats_expX( clean_assembly_filename, expX )
-	assembly_name = '.'.join( clean_assembly_filename.split('/')[-1].split('.')[:-1] )	
+	labels = get_assembly_labels( assembly_files )
+	all_stats = analyze_assemblies(	assembly_files, labels, threads, output_dir=output_dir, cutoff=cutoff, expX=expX, header_patterns=header_patterns,
+									genome_size=genome_size, stats_only='--stats_only' in arguments, lengths_only='--lengths_only' in arguments,
+									bgzip='--bgzip' in arguments, write_index='--fai' in arguments )
 	
-	# ---- write all results of the evaluation to file --- #
-	write_NExp_evaluation_to_file( stats_outputfile, formal_assembly_stats, assembly_name, percent_cutoff )
+	# --- compare multiple assemblies --- #
+	if '--in_list' in arguments or '--in_dir' in arguments:
+		if output_dir is not None:
+			comparison_dir = output_dir
+		analyzed = [ idx for idx, stats in enumerate( all_stats ) if stats is not None ]	#failed assemblies are left out
+		if len( analyzed ) == 0:
+			sys.exit( "ERROR: analysis of all assemblies failed" )
+		assembly_files, labels, all_stats = [ assembly_files[ idx ] for idx in analyzed ], [ labels[ idx ] for idx in analyzed ], [ all_stats[ idx ] for idx in analyzed ]
+		write_assembly_comparison( comparison_dir + "assembly_comparison", assembly_files, labels, all_stats )
+		generate_nx_figure( comparison_dir + "assembly_comparison_Nx.png", labels, all_stats )
 
 
-if '--input' in sys.argv:
-	main( sys.argv )
-elif '--in' in sys.argv:
-	main( sys.argv )
-else:
-	sys.exit( __usage__ )
+if __name__ == '__main__':	#worker processes of the pool must not run main again
+	if '--input' in sys.argv or '--in' in sys.argv or '--in_list' in sys.argv or '--in_dir' in sys.argv:
+		main( sys.argv )
+	else:
+		sys.exit( __usage__ )